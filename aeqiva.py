@@ -0,0 +1,474 @@
+# Asyncio Eqiva radiator thermostat module (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import asyncio
+import eqiva
+import time
+try:
+    from micropython import const
+    import bluetooth
+except ImportError:  # CPython, only usable with the simulator transport
+    from simulator import const
+    bluetooth = None
+from eqiva import REPLY_SERIAL, REPLY_STATUS, REPLY_TIMER_SET, REPLY_ACK
+
+# BLE IRQ event constants
+_IRQ_SCAN_RESULT = const(5)
+_IRQ_SCAN_DONE = const(6)
+_IRQ_PERIPHERAL_CONNECT = const(7)
+_IRQ_PERIPHERAL_DISCONNECT = const(8)
+_IRQ_GATTC_NOTIFY = const(18)
+
+
+class AsyncEqiva(eqiva.Eqiva):
+    """Awaitable variant of Eqiva. Uses the same protocol encoding, but never blocks the interpreter."""
+
+    def __init__(self, utc_offset=1, timeout=2, ble=None, transport=None, write_response=True):
+        # transport: BLE backend for standalone use (e.g. simulator.SimBLE), see eqiva.Eqiva
+        # Flags are completed from the BLE IRQ and awaited by the tasks
+        self._connected = asyncio.ThreadSafeFlag()
+        self._disconnected = asyncio.ThreadSafeFlag()
+        self._replied = asyncio.ThreadSafeFlag()
+        self._lock = asyncio.Lock()  # One request in flight per connection
+        self.gap = None  # EqivaManager that serializes the connection attempts
+        super().__init__(utc_offset, timeout, ble, transport, write_response)
+
+    def _irq_handler(self, event, data):
+        """Handle BLE events and wake up the waiting task."""
+        super()._irq_handler(event, data)
+
+        if event == _IRQ_PERIPHERAL_CONNECT:
+            self._connected.set()
+        elif event == _IRQ_PERIPHERAL_DISCONNECT:
+            self._disconnected.set()
+
+    def _on_notify(self, data):
+        """Handle one decoded notification and wake up the waiting task."""
+        super()._on_notify(data)
+        if self._response is not None:
+            self._replied.set()
+
+    async def _request(self, command, expect):
+        """Write a command and wait until the matching notification arrives. The caller holds _lock."""
+        if self.write_response:
+            attempts, wait_ms = 1, self.timeout_ms
+        else:
+            attempts, wait_ms = 1 + eqiva.WRITE_RETRIES, self.metrics.reply_timeout_ms(self.timeout_ms)
+        self._expect = expect
+        self._response = None
+        start = time.ticks_ms()
+
+        for attempt in range(attempts):
+            if attempt:
+                print("No reply, sending again")
+                self.metrics.retries += 1
+            self._replied.clear()
+            self.ble.gattc_write(self.conn_handle, eqiva.HANDLE_WRITE, command, 1 if self.write_response else 0)
+
+            try:
+                await asyncio.wait_for_ms(self._replied.wait(), wait_ms)
+            except asyncio.TimeoutError:
+                self._process()  # In case the scheduler queue was full
+            if self._response is not None:
+                break
+
+        self._expect = None
+        self.metrics.replied(time.ticks_diff(time.ticks_ms(), start) if self._response is not None else None)
+        return self._response
+
+    async def _status_request(self, command):
+        """Write a command that is answered with a status notification."""
+        data = await self._request(command, REPLY_STATUS)
+        if data is None or len(data) < 6:
+            raise Exception("Failed to read status")
+        return self.status.to_dict()
+
+    async def connect(self, addr_str, max_retries=3):
+        """Connect to Eqiva thermostat with retries.
+
+        Timeouts and waits between the attempts follow the device's history (see eqiva.Metrics).
+        """
+        self._set_addr(self._addr_to_bytes(addr_str))
+
+        # Do not block on a device that just failed (e.g. empty battery)
+        holdoff = self.metrics.holdoff_ms()
+        if holdoff:
+            raise Exception(f"Device unreachable, next try in {holdoff // 1000} s")
+        timeout_ms = self.metrics.connect_timeout_ms(self.registry.rssi(addr_str))
+        if self.metrics.failures_in_row:
+            max_retries = 1  # Probe only, the last connect() failed
+
+        for attempt in range(max_retries):
+            print(f"Connection attempt {attempt + 1}/{max_retries}")
+
+            # The manager allows one pending connect on the stack, it is only held for the attempt
+            if self.gap is not None:
+                await self.gap.begin_connect(self)
+            try:
+                # Reset connection state
+                if self.is_connected:
+                    await self.disconnect()
+
+                # Make sure BLE is active
+                if not self.ble.active():
+                    self.ble.active(True)
+                    await asyncio.sleep_ms(100)
+
+                print("Connecting to", addr_str)
+                start = time.ticks_ms()
+                self._connected.clear()
+                self.ble.gap_connect(0, self.addr)
+
+                # Wait for the connect event
+                await asyncio.wait_for_ms(self._connected.wait(), timeout_ms)
+                print("Connection successful")
+                self.metrics.attempt(time.ticks_diff(time.ticks_ms(), start))
+                return True
+
+            except asyncio.TimeoutError:
+                print("Connection attempt timed out")
+                self._cancel_connect()
+
+            except Exception as e:
+                print(f"Connection attempt failed: {e}")
+
+            finally:
+                if self.gap is not None:
+                    self.gap.end_connect()
+
+            self.metrics.attempt(None)
+
+            # Wait before retry
+            if attempt < max_retries - 1:
+                backoff = self.metrics.backoff_ms(attempt)
+                print(f"Waiting {backoff} ms before retry...")
+                await asyncio.sleep_ms(backoff)
+
+        self.metrics.connect_failed()
+        raise Exception("Failed to connect after all retries")
+
+    async def disconnect(self):
+        """Disconnect from thermostat."""
+        if self.conn_handle is not None:
+            self._disconnected.clear()
+            self.ble.gap_disconnect(self.conn_handle)
+            try:
+                await asyncio.wait_for(self._disconnected.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        self.conn_handle = None
+        self.is_connected = False
+
+    async def scan(self, timeout=10):
+        """Scan for Eqiva thermostats."""
+        found_devices = set()
+        done = asyncio.ThreadSafeFlag()
+
+        def _irq_handler_scan(event, data):
+            if event == _IRQ_SCAN_RESULT:
+                eqiva.scan_result(found_devices, data, self.registry)
+
+            elif event == _IRQ_SCAN_DONE:
+                print("Scan complete")
+                done.set()
+
+        try:
+            # Set our scan handler
+            self.ble.irq(_irq_handler_scan)
+
+            # Start scanning
+            print(f"Scanning for {timeout} seconds...")
+            self.ble.gap_scan(timeout * 1000, 30000, 30000)
+
+            # Wait for the scan to complete
+            try:
+                await asyncio.wait_for(done.wait(), timeout + 1)
+            except asyncio.TimeoutError:
+                self.ble.gap_scan(None)
+
+        finally:
+            # Restore the original handler
+            self.ble.irq(self._irq_handler)
+
+        return list(found_devices)
+
+    # Commands hold the lock from encoding to the reply, the command buffers are per device
+
+    async def get_serial(self):
+        """Read the serial number, firmware version and PIN."""
+        async with self._lock:
+            info = self._parse_serial(await self._request(self._enc.serial(), REPLY_SERIAL))
+        self._update('info', info)
+        return info
+
+    async def get_status(self):
+        """Request a status update from the thermostat."""
+        async with self._lock:
+            return await self._status_request(self._cmd_status())
+
+    async def set_mode(self, mode, temp=-1.0, day=0, month=0, year=0, t=(0, 0)):
+        """Switch mode (MANUAL, AUTO, VACATION)."""
+        async with self._lock:
+            return await self._status_request(self._cmd_mode(mode, temp, day, month, year, t))
+
+    async def set_temp(self, temp, mode=-1):
+        """Set target temperature / boost (ON / OFF)."""
+        async with self._lock:
+            return await self._status_request(self._cmd_temp(temp, mode))
+
+    async def get_timer(self, day):
+        """Read timer of a specific day."""
+        async with self._lock:
+            command = self._cmd_get_timer(day)
+            index = command[1]
+            data = await self._request(command, eqiva.TIMER_REPLY[index])
+        events = self._parse_timer(data)
+        self._week_put(index, data[2:16])
+        self._update('timer/' + eqiva.DAYS[index], events)
+        return events
+
+    async def set_timer(self, day, temps_times):
+        """Set timer for a specific day."""
+        async with self._lock:
+            command = self._cmd_set_timer(day, temps_times)
+            index, payload = command[1], bytes(command[2:])
+            res = self._parse_timer_ack(await self._request(command, REPLY_TIMER_SET))
+        self._week_put(index, payload)
+        self._update('timer/' + eqiva.DAYS[index], self._week_from_cache(index))
+        return res
+
+    async def get_week(self, cached=False):
+        """Read the timers of all days. With cached=True the last read / written schedule is used if
+        complete and not older than week_ttl."""
+        if not cached or not self._week_cached():
+            for day in eqiva.DAYS:
+                await self.get_timer(day)
+        return self._week_from_cache()
+
+    async def set_week(self, schedule):
+        """Set the timers of several days {day: temps_times}. Only days that differ from the cache are
+        sent, days cached longer than week_ttl ago are always sent."""
+        written = []
+        for day, temps_times in schedule.items():
+            if self._week_changed(day, temps_times):
+                await self.set_timer(day, temps_times)
+                written.append(day.upper())
+        return written
+
+    async def conf_comfort_eco(self, comfort_temp, eco_temp):
+        """Configure comfort and eco temperatures."""
+        async with self._lock:
+            return await self._status_request(self._cmd_comfort_eco(comfort_temp, eco_temp))
+
+    async def conf_window_open(self, temp, duration):
+        """Configure window open mode."""
+        async with self._lock:
+            return await self._status_request(self._cmd_window_open(temp, duration))
+
+    async def conf_offset(self, offset):
+        """Set temperature offset."""
+        async with self._lock:
+            return await self._status_request(self._cmd_offset(offset))
+
+    async def set_lock(self, lock):
+        """Lock the thermostat."""
+        async with self._lock:
+            return await self._status_request(self._cmd_lock(lock))
+
+    async def factory_reset(self):
+        """Perform a factory rest."""
+        self._week = {}
+        self._update('reset', None)
+        async with self._lock:
+            return self._parse_reset_ack(await self._request(self._enc.factory_reset(), REPLY_ACK))
+
+
+class EqivaManager:
+    """Several concurrent thermostat connections on one BLE stack, keyed by MAC."""
+
+    def __init__(self, utc_offset=1, timeout=2, max_connections=4, transport=None, write_response=True):
+        self.ble = transport if transport is not None else bluetooth.BLE()
+        if self.ble.active():
+            self.ble.active(False)  # Reset a stack left running by a soft reset, cold boots skip this
+            time.sleep(0.1)
+        self.ble.active(True)
+        self.ble.irq(self._irq_handler)
+        self.utc_offset = utc_offset
+        self.timeout = timeout
+        self.write_response = write_response
+        self.max_connections = max_connections  # NimBLE limit of concurrent central connections
+        self.devices = {}  # MAC -> AsyncEqiva
+        self._handles = {}  # conn_handle -> AsyncEqiva
+        self._locks = {}  # MAC -> asyncio.Lock
+        self.registry = eqiva.Registry()  # Thermostats seen by scans and the background scan
+        self._background = None  # (interval_us, window_us) of the background scan
+        self._background_since = 0  # ticks_ms
+        self.seen_max_age = 300  # s, with the background scan running, devices not heard for longer are not connected
+        self.week_ttl = 3600  # s, cached schedules of the devices (see eqiva.Eqiva.week_ttl)
+        self._scan_stopped = asyncio.ThreadSafeFlag()
+        self._pending = None  # Device with a gap_connect in progress
+        self.on_update = None  # Called with (mac, kind, value) for decoded data of any device
+        self._scan_irq = None
+        self._gap_lock = asyncio.Lock()  # The stack allows only one pending connect or scan
+
+    def _irq_handler(self, event, data):
+        """Route BLE events to the device they belong to."""
+        if event == _IRQ_PERIPHERAL_CONNECT:
+            dev = self._pending
+            if dev is None:
+                # Late connect after a timeout or cancel: nobody waits for it, free the stack's slot
+                self.ble.gap_disconnect(data[0])
+                return
+            self._handles[data[0]] = dev
+
+        elif event == _IRQ_SCAN_RESULT or event == _IRQ_SCAN_DONE:
+            if self._scan_irq:
+                self._scan_irq(event, data)
+            elif event == _IRQ_SCAN_RESULT:
+                self.registry.seen(data[1], data[3], data[4])
+            else:
+                self._scan_stopped.set()
+            return
+
+        elif event == _IRQ_PERIPHERAL_DISCONNECT:
+            dev = self._handles.pop(data[0], None)
+
+        else:
+            # Notifications start with the conn_handle as well
+            dev = self._handles.get(data[0])
+
+        if dev is not None:
+            dev._irq_handler(event, data)
+
+    def _update(self, mac, kind, value):
+        if self.on_update:
+            self.on_update(mac, kind, value)
+
+    def get(self, mac):
+        """Return the device object of a MAC (connected or not)."""
+        mac = mac.upper()
+        dev = self.devices.get(mac)
+        if dev is None:
+            dev = AsyncEqiva(self.utc_offset, self.timeout, self.ble, write_response=self.write_response)
+            dev.on_update = lambda kind, value: self._update(mac, kind, value)
+            dev.registry = self.registry
+            dev.week_ttl = self.week_ttl
+            dev.gap = self
+            self.devices[mac] = dev
+            self._locks[mac] = asyncio.Lock()
+        return dev
+
+    def metrics(self):
+        """Compact per MAC metrics of all known devices and their smoothed RSSI."""
+        res = {}
+        for mac, dev in self.devices.items():
+            res[mac] = dev.metrics.compact()
+        for mac in self.registry.macs():
+            res.setdefault(mac, {})["rssi"] = self.registry.rssi(mac)
+        return res
+
+    def lock(self, mac):
+        """Lock for a connect / command / disconnect sequence on one device."""
+        self.get(mac)
+        return self._locks[mac.upper()]
+
+    def connected(self):
+        """MACs of all connected devices."""
+        return [mac for mac, dev in self.devices.items() if dev.is_connected]
+
+    async def connect(self, mac, max_retries=3):
+        """Connect to a device, other connections stay open."""
+        dev = self.get(mac)
+        if dev.is_connected:
+            return dev
+        if len(self._handles) >= self.max_connections:
+            raise Exception("Too many connections")
+
+        # Fail fast for thermostats the background scan has not heard for a while
+        if self._background is not None and \
+                time.ticks_diff(time.ticks_ms(), self._background_since) > self.seen_max_age * 1000 and \
+                not self.registry.in_range(mac, self.seen_max_age):
+            raise Exception("Device not in range")
+
+        await dev.connect(mac, max_retries)
+        return dev
+
+    async def begin_connect(self, dev):
+        """Called by a device before a connection attempt, only one may be pending at a time."""
+        await self._gap_lock.acquire()
+        await self._pause_scan()
+        self._pending = dev
+
+    def end_connect(self):
+        self._pending = None
+        self._resume_scan()
+        self._gap_lock.release()
+
+    async def disconnect(self, mac):
+        """Disconnect a device."""
+        dev = self.devices.get(mac.upper())
+        if dev is not None:
+            await dev.disconnect()
+
+    async def disconnect_all(self):
+        """Disconnect all devices at once."""
+        await asyncio.gather(*[dev.disconnect() for dev in self.devices.values() if dev.is_connected])
+
+    async def scan(self, timeout=10):
+        """Scan for Eqiva thermostats, open connections are kept."""
+        found_devices = set()
+        done = asyncio.ThreadSafeFlag()
+
+        def _irq_handler_scan(event, data):
+            if event == _IRQ_SCAN_RESULT:
+                eqiva.scan_result(found_devices, data, self.registry)
+
+            elif event == _IRQ_SCAN_DONE:
+                print("Scan complete")
+                done.set()
+
+        async with self._gap_lock:
+            await self._pause_scan()
+            try:
+                self._scan_irq = _irq_handler_scan
+                print(f"Scanning for {timeout} seconds...")
+                self.ble.gap_scan(timeout * 1000, 30000, 30000)
+
+                # Wait for the scan to complete
+                try:
+                    await asyncio.wait_for(done.wait(), timeout + 1)
+                except asyncio.TimeoutError:
+                    self.ble.gap_scan(None)
+            finally:
+                self._scan_irq = None
+                self._resume_scan()
+
+        return list(found_devices)
+
+    def start_background_scan(self, interval_us=1280000, window_us=11250):
+        """Scan passively all the time (default duty cycle < 1 %) and keep the registry up to date.
+
+        The scan pauses while a device connects or scan() runs.
+        """
+        self._background = (interval_us, window_us)
+        self._background_since = time.ticks_ms()
+        self._resume_scan()
+
+    def stop_background_scan(self):
+        if self._background is not None:
+            self._background = None
+            self.ble.gap_scan(None)
+
+    async def _pause_scan(self):
+        # The stack cannot connect while scanning, wait until the scan has stopped
+        if self._background is not None:
+            self._scan_stopped.clear()
+            self.ble.gap_scan(None)
+            try:
+                await asyncio.wait_for_ms(self._scan_stopped.wait(), 500)
+            except asyncio.TimeoutError:
+                pass
+
+    def _resume_scan(self):
+        if self._background is not None:
+            self.ble.gap_scan(0, self._background[0], self._background[1], False)
@@ -0,0 +1,231 @@
+# End-to-end benchmarks: command latency of Eqiva and throughput of the MQTT gateway
+# v0.2 (c) Copyright prefixFelix 2025
+#
+# PC, simulated thermostats:
+#   $ python3 benchmarks/bench.py [iterations] [max_devices] [latency_ms] [loss]
+# ESP32, real thermostats: set MACS below, copy eqiva.py, eq3codec.py, aeqiva.py and the gateway files,
+# benchmarks/broker.py and this file onto the device:
+#   $ mpremote connect /dev/ttyUSB0 run benchmarks/bench.py
+#
+# Reports p50/p95/p99 latency per command (write with / without response), gateway commands per second for 1..N thermostats
+# (MQTT messages go through an in-process broker stand-in) and the peak heap usage.
+
+import gc
+import json
+import sys
+import time
+
+MACS = []  # ESP32 only: thermostats to use, e.g. ["00:1A:22:XX:XX:XX"]
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+if sys.implementation.name != 'micropython':
+    # Run from the repository, the gateway's device modules are replaced by stand-ins
+    import os
+    import types
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:0] = [os.path.join(root, 'benchmarks'), root, os.path.join(root, 'mqtt-gateway')]
+    import simulator
+    from broker import MQTTClient
+
+    for name in ('network', 'ntptime', 'umqtt', 'umqtt.simple'):
+        sys.modules.setdefault(name, types.ModuleType(name))
+    sys.modules['umqtt.simple'].MQTTClient = MQTTClient
+else:
+    simulator = None
+
+import asyncio
+import eqiva
+import aeqiva
+from broker import Broker, MQTTClient
+
+VERBOSE = False  # The modules log every connect and request, which would drown the report
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+TIMER = ((17.0, None, None), (21.0, 6, 0), (17.0, 8, 30), (21.0, 17, 0), (17.0, 22, 0))
+
+COMMANDS = (
+    ('status', lambda eq: eq.get_status()),
+    ('temp', lambda eq: eq.set_temp(21.5)),
+    ('mode', lambda eq: eq.set_mode(eqiva.MODE_MANUAL)),
+    ('offset', lambda eq: eq.conf_offset(0.5)),
+    ('serial', lambda eq: eq.get_serial()),
+    ('get_timer', lambda eq: eq.get_timer('MON')),
+    ('set_timer', lambda eq: eq.set_timer('MON', TIMER)),
+)
+
+
+class Heap:
+    """Peak heap usage: tracemalloc on CPython, sampled gc.mem_alloc() on MicroPython."""
+
+    def start(self):
+        gc.collect()
+        self.peak = 0
+        if tracemalloc:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        else:
+            self.base = gc.mem_alloc()
+
+    def sample(self):
+        if not tracemalloc:
+            self.peak = max(self.peak, gc.mem_alloc() - self.base)
+
+    def stop(self):
+        if tracemalloc:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return self.peak
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1) + 0.5)]
+
+
+def report(name, values, errors=0):
+    if not values:
+        print(f"{name:<10} {'-':>8} {'-':>8} {'-':>8} {errors:>7}")
+        return
+    print(f"{name:<10} {percentile(values, 0.5):>8} {percentile(values, 0.95):>8} {percentile(values, 0.99):>8} "
+          f"{errors:>7}")
+
+
+def transport(n, args):
+    if simulator is None:
+        return None
+    return simulator.SimBLE.fleet(n, latency_ms=args['latency'], loss=args['loss'], seed=1)
+
+
+def macs(n):
+    if simulator is None:
+        return MACS[:n]
+    return ["00:1A:22:00:00:{:02X}".format(i + 1) for i in range(n)]
+
+
+def bench_commands(args):
+    """Latency (ms) of every Eqiva command, blocking API."""
+    print(f"\nCommand latency, {args['iterations']} iterations (ms)")
+    print(f"{'command':<10} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    heap = Heap()
+    heap.start()
+    eq = eqiva.Eqiva(timeout=1, transport=transport(1, args))
+    mac = macs(1)[0]
+
+    times = []
+    for _ in range(min(args['iterations'], 3)):
+        start = time.ticks_ms()
+        eq.connect(mac)
+        times.append(time.ticks_diff(time.ticks_ms(), start))
+        eq.disconnect()
+    report('connect', times)
+
+    eq.connect(mac)
+    for write_response in (True, False):
+        eq.write_response = write_response
+        print(f"-- write {'with' if write_response else 'without'} response")
+        for name, cmd in COMMANDS:
+            times = []
+            errors = 0
+            for _ in range(args['iterations']):
+                start = time.ticks_ms()
+                try:
+                    cmd(eq)
+                    times.append(time.ticks_diff(time.ticks_ms(), start))
+                except Exception:
+                    errors += 1
+                heap.sample()
+            report(name, times, errors)
+    print(f"retries: {eq.metrics.retries}")
+    eq.disconnect()
+
+    start = time.ticks_ms()
+    eq.scan(timeout=1)
+    report('scan(1s)', [time.ticks_diff(time.ticks_ms(), start)])
+    print(f"peak heap: {heap.stop()} B")
+
+
+async def run_gateway(n, commands, args):
+    import config
+    import gateway
+    import pool
+    if not VERBOSE:
+        gateway.print = pool.print = _quiet
+    config.QUEUE_SIZE = max(config.QUEUE_SIZE, commands)  # All commands are published at once
+    config.POLL_INTERVAL = 0  # Only the benchmark's commands
+    gateway.clock_synced = True  # No NTP, the host clock is set
+    config.JOURNAL_MAX = 0  # The broker stand-in never fails
+    # Every command reaches its thermostat: nothing is merged in the queue or skipped as already set
+    config.SHADOW = False
+    gateway.coalesce = lambda prio, mac, msg_j: False
+
+    broker = Broker()
+    gateway.client = MQTTClient(broker=broker)
+    gateway.client.set_callback(gateway.sub)
+    gateway.client.connect()
+    gateway.client.subscribe(f'{config.DEVICE_NAME}/radin/trv'.encode())
+    gateway.setup(transport=transport(n, args))
+
+    tester = MQTTClient(broker=broker)
+    tester.connect()
+    tester.subscribe(f'{config.DEVICE_NAME}/radout/status'.encode())
+
+    heap = Heap()
+    heap.start()
+    devices = macs(n)
+    start = time.ticks_ms()
+    for i in range(commands):
+        msg = {"mac": devices[i % n], "cmd": "temp", "params": 18.0 + (i % 8) / 2}
+        tester.publish(f'{config.DEVICE_NAME}/radin/trv'.encode(), json.dumps(msg).encode())
+
+    errors = 0
+    while len(tester.inbox) < commands:
+        gateway.client.check_msg()
+        heap.sample()
+        await asyncio.sleep_ms(1)
+    duration = time.ticks_diff(time.ticks_ms(), start)
+    for topic, msg in tester.inbox:
+        errors += 'error' in json.loads(msg)
+
+    print(f"{n:>7} {commands:>8} {commands * 1000 / duration:>9.2f} {errors:>7} {heap.stop():>9} "
+          f"{gateway.pool.stats()}")
+    await gateway.pool.close()
+
+
+def bench_gateway(args):
+    """Gateway commands per second for 1..N thermostats."""
+    print(f"\nGateway throughput, {args['iterations']} temp commands per thermostat")
+    print(f"{'devices':>7} {'commands':>8} {'cmds/s':>9} {'errors':>7} {'peak heap':>9} pool")
+    n = 1
+    while n <= args['devices']:
+        asyncio.run(run_gateway(n, n * args['iterations'], args))
+        n *= 2
+
+
+def main(argv):
+    args = {
+        'iterations': int(argv[1]) if len(argv) > 1 else 20,
+        'devices': int(argv[2]) if len(argv) > 2 else (8 if simulator else len(MACS)),
+        'latency': int(argv[3]) if len(argv) > 3 else 30,
+        'loss': float(argv[4]) if len(argv) > 4 else 0.0,
+    }
+    if simulator is None and not MACS:
+        print("Set MACS to the thermostats to use")
+        return
+    if not VERBOSE:
+        eqiva.print = aeqiva.print = _quiet
+    if simulator:
+        print(f"Simulated thermostats, latency {args['latency']} ms, loss {args['loss']}")
+
+    bench_commands(args)
+    bench_gateway(args)
+
+
+main(sys.argv)
@@ -0,0 +1,68 @@
+# In-process MQTT broker stand-in for benchmarks (CPython / MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import time
+
+
+class Broker:
+    """Routes messages between clients in memory, topics match exactly. Retained messages are kept."""
+
+    def __init__(self):
+        self.clients = []
+        self.retained = {}  # topic -> msg
+        self.published = 0
+
+    def route(self, topic, msg, retain=False):
+        self.published += 1
+        if retain:
+            self.retained[topic] = msg
+        for client in self.clients:
+            if topic in client.topics:
+                client.inbox.append((topic, msg))
+
+
+class MQTTClient:
+    """umqtt.simple.MQTTClient interface on top of a Broker."""
+
+    def __init__(self, client_id=b'', server=b'', port=0, user=None, password=None, keepalive=0, ssl=None,
+                 broker=None):
+        self.broker = broker if broker is not None else Broker()
+        self.topics = []
+        self.inbox = []
+        self.cb = None
+        self.sent = []  # (ticks_ms, topic, msg) of own publishes
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def connect(self, clean_session=True):
+        if self not in self.broker.clients:
+            self.broker.clients.append(self)
+        return 0
+
+    def disconnect(self):
+        if self in self.broker.clients:
+            self.broker.clients.remove(self)
+
+    def ping(self):
+        pass
+
+    def subscribe(self, topic, qos=0):
+        self.topics.append(topic)
+        if topic in self.broker.retained:
+            self.inbox.append((topic, self.broker.retained[topic]))
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self.sent.append((time.ticks_ms(), topic, msg))
+        self.broker.route(topic, msg, retain)
+
+    def check_msg(self):
+        """Deliver one pending message to the callback."""
+        if self.inbox:
+            topic, msg = self.inbox.pop(0)
+            self.cb(topic, msg)
+
+    def wait_msg(self):
+        while not self.inbox:
+            time.sleep_ms(10)
+        self.check_msg()
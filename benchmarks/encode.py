@@ -0,0 +1,79 @@
+# Command encoder benchmark: heap allocation and encodes per second, list encoders (v0.2) vs. eq3codec.Encoder
+# Run on the ESP32: mpremote connect /dev/ttyUSB0 cp eq3codec.py :/lib/ + run benchmarks/encode.py
+# On a PC: PYTHONPATH=. python3 benchmarks/encode.py
+
+import gc
+import time
+import eq3codec
+
+N = 2000
+
+DAYS = ["SAT", "SUN", "MON", "TUE", "WED", "THU", "FRI"]
+TIMER = ((17.0, None, None), (21.0, 6, 0), (17.0, 8, 30), (21.0, 17, 0), (17.0, 22, 0))
+
+
+def temp_v02(temp):
+    """The v0.2 temperature command, kept as reference."""
+    if not 4.5 <= temp <= 30:
+        raise ValueError("Temperature must be between 4.5°C and 30°C")
+    return bytearray([0x41, int(temp * 2)])
+
+
+def set_timer_v02(day, temps_times):
+    """The v0.2 set timer command, kept as reference."""
+    day = day.upper()
+    if day not in DAYS:
+        raise ValueError("Not a valid day")
+    command = [0x10, DAYS.index(day), int(temps_times[0][0] * 2)]
+    for temp, hour, minute in temps_times[1:]:
+        command.append((hour * 60 + minute) // 10)
+        command.append(int(temp * 2))
+    command.append(24 * 6)
+    while len(command) < 16:
+        command.append(0)
+    return bytearray(command)
+
+
+def mem_alloc():
+    try:
+        return gc.mem_alloc()
+    except AttributeError:  # CPython has no allocation counter
+        return None
+
+
+def ticks_us():
+    try:
+        return time.ticks_us()
+    except AttributeError:
+        return time.perf_counter_ns() // 1000
+
+
+def bench(name, encode):
+    gc.collect()
+    gc.disable()  # mem_alloc() only grows while the GC is off
+    start_mem = mem_alloc()
+    start = ticks_us()
+    for _ in range(N):
+        encode()
+    duration = ticks_us() - start
+    end_mem = mem_alloc()
+    gc.enable()
+    gc.collect()
+
+    alloc = f"{(end_mem - start_mem) / N:>8.1f}" if start_mem is not None else "       -"
+    print(f"{name:<24} {alloc} B/cmd {N * 1000000 // max(duration, 1):>8d} cmds/s")
+
+
+enc = eq3codec.Encoder()
+
+# Both encoders must produce the same bytes (protocol round trips: tests/test_eq3codec.py)
+for temp in range(9, 61):
+    assert enc.temp(temp / 2) == temp_v02(temp / 2), temp
+for day in DAYS:
+    assert enc.set_timer(day.lower(), TIMER) == set_timer_v02(day, TIMER), day
+
+print(f"Encoding {N} commands")
+bench("temp list (v0.2)", lambda: temp_v02(21.5))
+bench("temp Encoder", lambda: enc.temp(21.5))
+bench("set_timer list (v0.2)", lambda: set_timer_v02('MON', TIMER))
+bench("set_timer Encoder", lambda: enc.set_timer('MON', TIMER))
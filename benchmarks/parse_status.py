@@ -0,0 +1,100 @@
+# Status parser benchmark: heap allocation and parses per second, dict parser (v0.2) vs. Status record
+# Run on the ESP32: mpremote connect /dev/ttyUSB0 cp eqiva.py :/lib/ + run benchmarks/parse_status.py
+
+import gc
+import time
+import eqiva
+
+N = 2000
+
+# Manual + DST, valve 0%, 21.0°, window open 12.0° / 30 min, comfort 21.0°, eco 17.0°, offset 0.0°
+SAMPLE = memoryview(bytes([0x02, 0x01, 0x09, 0x00, 0x04, 0x2a, 0x00, 0x00, 0x00, 0x00, 0x18, 0x06, 0x2a, 0x22, 0x07]))
+
+
+def parse_dict(data):
+    """The v0.2 parser, kept as reference."""
+    if not data or len(data) < 6:
+        return "Invalid data received"
+
+    status = {}
+    bytes_data = list(data)
+    mode_byte = bytes_data[2]
+    mode_flags = {
+        0x01: "manual",
+        0x02: "vacation",
+        0x04: "boost",
+        0x08: "dst",
+        0x10: "open window",
+        0x20: "locked",
+        0x40: "unknown",
+        0x80: "battery_low"
+    }
+
+    status["modes"] = []
+    if not (mode_byte & 0x01):
+        status["modes"].append("auto")
+    for flag, mode in mode_flags.items():
+        if mode_byte & flag:
+            status["modes"].append(mode)
+
+    status["temperature"] = bytes_data[5] / 2
+    status["valve"] = bytes_data[3]
+
+    if "vacation" in status["modes"] and len(bytes_data) > 10:
+        status["vacation"] = {
+            "day": bytes_data[6],
+            "month": bytes_data[9],
+            "year": bytes_data[7] + 2000,
+            "time": [(bytes_data[8] * 30) // 60, (bytes_data[8] * 30) % 60]
+        }
+
+    if len(bytes_data) > 14:
+        status["window_open_temp"] = bytes_data[10] / 2
+        status["window_open_time"] = bytes_data[11] * 5
+        status["comfort_temp"] = bytes_data[12] / 2
+        status["eco_temp"] = bytes_data[13] / 2
+        status["temp_offset"] = (bytes_data[14] - 7) / 2
+
+    return status
+
+
+def mem_alloc():
+    try:
+        return gc.mem_alloc()
+    except AttributeError:  # CPython has no allocation counter
+        return None
+
+
+def ticks_us():
+    try:
+        return time.ticks_us()
+    except AttributeError:
+        return time.perf_counter_ns() // 1000
+
+
+def bench(name, parse):
+    gc.collect()
+    gc.disable()  # mem_alloc() only grows while the GC is off
+    start_mem = mem_alloc()
+    start = ticks_us()
+    for _ in range(N):
+        parse(SAMPLE)
+    duration = ticks_us() - start
+    end_mem = mem_alloc()
+    gc.enable()
+    gc.collect()
+
+    alloc = f"{(end_mem - start_mem) / N:>8.1f}" if start_mem is not None else "       -"
+    print(f"{name:<24} {alloc} B/parse {N * 1000000 // max(duration, 1):>8d} parses/s")
+
+
+status = eqiva.Status()
+
+print(f"Parsing {N} status notifications")
+bench("dict parser (v0.2)", parse_dict)
+bench("Status.decode", status.decode)
+bench("Status.decode+to_dict", lambda data: status.decode(data) and status.to_dict())
+
+# The whole notification path of a device, as the BLE IRQ's scheduled callback runs it
+eq = eqiva.Eqiva(ble=object())  # Shared BLE stand-in, nothing is sent
+bench("Eqiva._on_notify", eq._on_notify)
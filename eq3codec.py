@@ -0,0 +1,214 @@
+# EQ3 protocol encoding / decoding for the Eqiva modules (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+#
+# Commands are built in preallocated buffers with lookup tables for the temperature and time
+# encodings, so encoding allocates nothing on the hot path.
+
+DAYS = ["SAT", "SUN", "MON", "TUE", "WED", "THU", "FRI"]
+
+# Day name (any case) -> index
+DAY_INDEX = {}
+for _i, _day in enumerate(DAYS):
+    DAY_INDEX[_day] = DAY_INDEX[_day.lower()] = DAY_INDEX[_day[0] + _day[1:].lower()] = _i
+
+# Temperature (0.5 °C steps) -> encoded value (°C x 2), 4.5 - 30.0 °C
+TEMP_CODE = {}
+for _i in range(9, 61):
+    TEMP_CODE[_i / 2] = _i
+
+# Encoded value -> temperature, decoding of status and timer replies
+TEMP_VALUE = [_i / 2 for _i in range(64)]
+
+# Offset (-3.5 - 3.5 °C, 0.5 °C steps) -> encoded value
+OFFSET_CODE = {}
+for _i in range(15):
+    OFFSET_CODE[(_i - 7) / 2] = _i
+
+# Expected reply prefix of a timer read, per day index
+TIMER_REPLY = [bytes([0x21, _i]) for _i in range(7)]
+
+TIME_END = 24 * 6  # 24:00 in 10 minute steps
+_time_str = None  # 10 minute step -> "HH:MM", built on first use
+
+
+def temp_code(temp, low=4.5, high=30.0):
+    """Encode a temperature, ValueError if it is out of range."""
+    if not low <= temp <= high:
+        raise ValueError(f"Temperature must be between {low:g}°C and {high:g}°C")
+    code = TEMP_CODE.get(temp)
+    if code is None:
+        code = int(temp * 2)  # Between two 0.5 °C steps, rounded down
+    return code
+
+
+def temp_value(code):
+    """Decode a temperature byte."""
+    return TEMP_VALUE[code] if code < 64 else code / 2
+
+
+def day_index(day):
+    """Index of a day name (SAT = 0), ValueError if it is none."""
+    index = DAY_INDEX.get(day)
+    if index is None:
+        index = DAY_INDEX.get(day.upper())
+        if index is None:
+            raise ValueError("Not a valid day")
+    return index
+
+
+def time_code(hour, minute):
+    """Encode a time of day in 10 minute steps."""
+    code = hour * 6 + minute // 10
+    if not 0 <= code <= TIME_END:
+        raise ValueError("Time must be between 00:00 and 24:00")
+    return code
+
+
+def time_str(code):
+    """Decode a 10 minute step to "HH:MM"."""
+    global _time_str
+    if _time_str is None:
+        _time_str = [f"{i // 6:02d}:{(i % 6) * 10:02d}" for i in range(TIME_END + 1)]
+    return _time_str[code] if code <= TIME_END else f"{code // 6:02d}:{(code % 6) * 10:02d}"
+
+
+def decode_timer(data):
+    """Timer events of a 0x21 reply: [(base temp, None), (temp, "HH:MM"), ...]."""
+    if not data or len(data) < 16:
+        raise Exception("Failed to read timer data")
+
+    # First temperature (midnight to first event)
+    events = [(temp_value(data[2]), None)]
+
+    # Remaining events: (time, temperature) pairs
+    for i in range(3, len(data) - 1, 2):
+        if data[i] == 0 and data[i + 1] == 0:
+            break
+        events.append((temp_value(data[i + 1]), time_str(data[i])))
+    return events
+
+
+class Encoder:
+    """Builds commands in preallocated buffers, one per command type.
+
+    A returned buffer is overwritten by the next command of the same type, write it before encoding
+    the next one.
+    """
+
+    def __init__(self):
+        self._status = bytearray(7)
+        self._status[0] = 0x03
+        self._mode = bytearray(b'\x40\x00')
+        self._vacation = bytearray(6)
+        self._vacation[0] = 0x40
+        self._temp = bytearray(b'\x41\x00')
+        self._boost = bytearray(b'\x45\x00')
+        self._get_timer = bytearray(b'\x20\x00')
+        self._set_timer = bytearray(16)
+        self._set_timer[0] = 0x10
+        self._comfort_eco = bytearray(b'\x11\x00\x00')
+        self._window_open = bytearray(b'\x14\x00\x00')
+        self._offset = bytearray(b'\x13\x00')
+
+    def serial(self):
+        """Serial number / firmware / PIN request."""
+        return b'\x00'
+
+    def status(self, t, utc_offset):
+        """Status request, which also sets the clock. t: time.localtime() tuple (UTC)."""
+        cmd = self._status
+        cmd[1] = t[0] - 2000  # Year (relative to 2000)
+        cmd[2] = t[1]  # Month
+        cmd[3] = t[2]  # Day
+        cmd[4] = t[3] + utc_offset  # Hour
+        cmd[5] = t[4]  # Minute
+        cmd[6] = t[5]  # Second
+        return cmd
+
+    def mode(self, mode):
+        """MANUAL / AUTO."""
+        self._mode[1] = mode
+        return self._mode
+
+    def vacation(self, temp, day, month, year, hour, minute):
+        cmd = self._vacation
+        cmd[1] = temp_code(temp) + 128
+        cmd[2] = day
+        cmd[3] = year - 2000
+        cmd[4] = (hour * 60 + minute) // 30  # 30 minute steps
+        cmd[5] = month
+        return cmd
+
+    def temp(self, temp):
+        self._temp[1] = temp_code(temp)
+        return self._temp
+
+    def preset(self, mode):
+        """Switch to the comfort (0x43) or eco (0x44) temperature."""
+        return b'\x43' if mode == 0x43 else b'\x44'
+
+    def boost(self, on):
+        self._boost[1] = 0xff if on else 0x00
+        return self._boost
+
+    def get_timer(self, day):
+        self._get_timer[1] = day_index(day)
+        return self._get_timer
+
+    def set_timer(self, day, temps_times):
+        """temps_times: [(base temp, None, None), (temp, hour, minute), ...], max 7 events."""
+        cmd = self._set_timer
+        cmd[1] = day_index(day)
+
+        # Initial midnight temperature, then each event's time and following temperature
+        cmd[2] = temp_code(temps_times[0][0], 0.0, 30.0)
+        pos = 3
+        for i in range(1, len(temps_times)):
+            if pos > 14:
+                raise ValueError("At most 7 temperature periods per day")
+            temp, hour, minute = temps_times[i]
+            cmd[pos] = time_code(hour, minute)
+            cmd[pos + 1] = temp_code(temp, 0.0, 30.0)
+            pos += 2
+
+        # Ensure that the last time is 24:00, pad remaining slots with zeros
+        if pos < 16:
+            cmd[pos] = TIME_END
+            pos += 1
+        else:
+            cmd[15] = TIME_END
+        for i in range(pos, 16):
+            cmd[i] = 0
+        return cmd
+
+    def comfort_eco(self, comfort_temp, eco_temp):
+        cmd = self._comfort_eco
+        cmd[1] = temp_code(comfort_temp, 5.0, 30.0)
+        cmd[2] = temp_code(eco_temp, 5.0, 30.0)
+        return cmd
+
+    def window_open(self, temp, duration):
+        """Window open temperature and duration (min, 5 minute steps)."""
+        if duration % 5 != 0:
+            raise ValueError("Duration must be a multiple of 5 minutes")
+        if not 0 <= duration <= 150:
+            raise ValueError("Duration must be between 0 and 150 minutes")
+        cmd = self._window_open
+        cmd[1] = temp_code(temp, 5.0, 30.0)
+        cmd[2] = duration // 5
+        return cmd
+
+    def offset(self, offset):
+        code = OFFSET_CODE.get(offset)
+        if code is None:
+            if not -3.5 <= offset <= 3.5:
+                raise ValueError("Offset must be between -3.5°C and 3.5°C")
+            raise ValueError("Offset must be in 0.5°C steps")
+        self._offset[1] = code
+        return self._offset
+
+    def lock(self, lock):
+        return b'\x80\x01' if lock else b'\x80\x00'
+
+    def factory_reset(self):
+        return b'\xf0'
@@ -1,10 +1,17 @@
 # Simple Eqiva radiator thermostat module (MicroPython)
 # v0.2 (c) Copyright prefixFelix 2025
 
-from micropython import const
-import bluetooth
-import ubinascii
+import random
 import time
+try:
+    from micropython import const, schedule
+    import bluetooth
+    import ubinascii
+except ImportError:  # CPython, only usable with the simulator transport
+    from simulator import const, schedule
+    import binascii as ubinascii
+    bluetooth = None
+from eq3codec import DAYS, TIMER_REPLY, Encoder, decode_timer, temp_value
 
 # BLE IRQ event constants
 _IRQ_SCAN_RESULT = const(5)
@@ -13,6 +20,17 @@ _IRQ_PERIPHERAL_CONNECT = const(7)
 _IRQ_PERIPHERAL_DISCONNECT = const(8)
 _IRQ_GATTC_NOTIFY = const(18)
 
+# Log every notification (raw bytes and decoded status). Costs a hex string and a status dict per
+# notification, so it is off unless debugging: eqiva.DEBUG = True
+DEBUG = False
+
+# Polling interval while waiting for a notification (ms)
+_POLL_MS = const(5)
+
+# Notification ring buffer, filled by the IRQ and drained outside of it
+_RING_SLOTS = const(8)
+_RING_SLOT_SIZE = const(20)  # Max. ATT payload with the default MTU
+
 # EQ3 specific constants
 HANDLE_WRITE = const(0x0411)  # Write handle for commands
 HANDLE_NOTIFY = const(0x0421)  # Notification handle
@@ -25,23 +43,390 @@ ECO = const(0x44)
 BOOST_ON = const(0xff)
 BOOST_OFF = const(0x00)
 
-DAYS = ["SAT", "SUN", "MON", "TUE", "WED", "THU", "FRI"]
+# Expected notification prefixes (reply matching)
+REPLY_SERIAL = b'\x01'
+REPLY_STATUS = b'\x02\x01'
+REPLY_TIMER_SET = b'\x02\x02'
+REPLY_ACK = b'\x02'
+
+# Status mode flags (byte 2)
+MODE_FLAGS = (
+    (0x01, "manual"),
+    (0x02, "vacation"),
+    (0x04, "boost"),
+    (0x08, "dst"),
+    (0x10, "open window"),
+    (0x20, "locked"),
+    (0x40, "unknown"),
+    (0x80, "battery_low"),
+)
+
+
+class Status:
+    """Decoded status notification.
+
+    The raw bytes are copied into a fixed buffer, so decoding allocates nothing.
+    Values are only converted on access, to_dict() builds the JSON-ready dict.
+    """
+    __slots__ = ('_raw', 'length')
+
+    def __init__(self):
+        self._raw = bytearray(16)
+        self.length = 0
+
+    def decode(self, data):
+        """Copy a status notification (bytes / memoryview), False if it is too short."""
+        n = len(data)
+        if n < 6:
+            return False
+        if n > 16:
+            n = 16
+        raw = self._raw
+        for i in range(n):
+            raw[i] = data[i]
+        self.length = n
+        return True
+
+    def raw(self):
+        """The undecoded notification."""
+        return memoryview(self._raw)[:self.length]
+
+    @property
+    def mode(self):
+        """Mode flags bitmask (see MODE_FLAGS)."""
+        return self._raw[2]
+
+    @property
+    def valve(self):
+        """Valve position in %."""
+        return self._raw[3]
+
+    @property
+    def temperature(self):
+        """Target temperature."""
+        return temp_value(self._raw[5])
+
+    @property
+    def extended(self):
+        """True if window open / comfort / eco / offset values are included."""
+        return self.length > 14
+
+    @property
+    def window_open_temp(self):
+        return temp_value(self._raw[10]) if self.extended else None
+
+    @property
+    def window_open_time(self):
+        """Window open interval in minutes."""
+        return self._raw[11] * 5 if self.extended else None
+
+    @property
+    def comfort_temp(self):
+        return temp_value(self._raw[12]) if self.extended else None
+
+    @property
+    def eco_temp(self):
+        return temp_value(self._raw[13]) if self.extended else None
+
+    @property
+    def temp_offset(self):
+        return (self._raw[14] - 7) / 2 if self.extended else None
+
+    def to_dict(self):
+        """Build the status dict (modes, temperature, valve, vacation, extended values)."""
+        raw = self._raw
+        mode_byte = raw[2]
+
+        modes = []
+        if not (mode_byte & 0x01):  # If bit 1 is not set
+            modes.append("auto")
+        for flag, mode in MODE_FLAGS:
+            if mode_byte & flag:
+                modes.append(mode)
+
+        status = {"modes": modes, "temperature": self.temperature, "valve": self.valve}
+
+        # If vacation mode is active (bytes 6-9)
+        if mode_byte & 0x02 and self.length > 10:
+            status["vacation"] = {
+                "day": raw[6],
+                "month": raw[9],
+                "year": raw[7] + 2000,
+                "time": [(raw[8] * 30) // 60, (raw[8] * 30) % 60]  # Hour, Min from 30 min counter
+            }
+
+        # Extended data if available (bytes 10-14)
+        if self.extended:
+            status["window_open_temp"] = self.window_open_temp
+            status["window_open_time"] = self.window_open_time
+            status["comfort_temp"] = self.comfort_temp
+            status["eco_temp"] = self.eco_temp
+            status["temp_offset"] = self.temp_offset
+
+        return status
+
+    def pack(self):
+        """Compact binary form: the notification without its 0x02 0x01 header (up to 14 bytes).
+
+        mode flags, valve %, 0x04, target temp x2, vacation day / year-2000 / 30 min counter / month,
+        window open temp x2, window open time / 5, comfort temp x2, eco temp x2, offset x2 + 7
+        """
+        return bytes(memoryview(self._raw)[2:self.length])
+
+
+# Latency histogram buckets, upper bounds in ms (plus one overflow bucket)
+LATENCY_BUCKETS = (50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-size latency histogram, recording does not allocate."""
+    __slots__ = ('counts', 'n', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ms):
+        i = 0
+        while i < len(LATENCY_BUCKETS) and ms > LATENCY_BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def compact(self):
+        """[count, avg ms, max ms, bucket counts...]"""
+        return [self.n, self.total // self.n if self.n else 0, self.max] + self.counts
+
+
+# Connection strategy (ms)
+_CONNECT_TIMEOUT_MIN = const(2000)  # Per attempt, adapted to the connect times seen so far
+_CONNECT_TIMEOUT_MAX = const(10000)
+_CONNECT_TIMEOUT_FIRST = const(5000)  # Per attempt, device without history
+_BACKOFF_BASE = const(500)  # Doubles with every attempt, randomized
+_BACKOFF_MAX = const(8000)
+_HOLDOFF = const(30000)  # A device whose connect() failed is not tried for this long, doubling
+_HOLDOFF_MAX = const(600000)
+WEAK_RSSI = const(-85)  # dBm, connects to weaker devices get more time
+
+# Write without response: resend a command if its notification does not arrive
+WRITE_RETRIES = const(2)
+_REPLY_TIMEOUT_MIN = const(300)  # ms per attempt, adapted to the reply times seen so far
+
+
+class Metrics:
+    """Connection and request statistics of one thermostat, they drive the connect strategy."""
+    __slots__ = ('connect_ms', 'reply_ms', 'connects', 'connect_failures', 'attempts', 'requests', 'timeouts',
+                 'retries', 'failure_rate', 'failures_in_row', '_failed_at')
+
+    def __init__(self):
+        self.connect_ms = Histogram()  # Duration of successful connection attempts
+        self.reply_ms = Histogram()  # Write to notification latency
+        self.connects = 0
+        self.connect_failures = 0  # connect() calls that used up all attempts
+        self.attempts = 0  # Connection attempts used in total
+        self.requests = 0
+        self.timeouts = 0
+        self.retries = 0  # Commands sent again because the notification was missing
+        self.failure_rate = 0  # Failed share of the recent connection attempts (%)
+        self.failures_in_row = 0
+        self._failed_at = 0  # ticks_ms of the last failed connect()
+
+    def attempt(self, ms):
+        """One connection attempt, ms is its duration or None if it failed."""
+        self.attempts += 1
+        self.failure_rate = (3 * self.failure_rate + (100 if ms is None else 0)) // 4
+        if ms is not None:
+            self.connect_ms.add(ms)
+            self.connects += 1
+            self.failures_in_row = 0
+
+    def connect_failed(self):
+        self.connect_failures += 1
+        self.failures_in_row += 1
+        self._failed_at = time.ticks_ms()
+
+    def connect_timeout_ms(self, rssi=None):
+        """How long to wait for one attempt: three times the usual connect time, more for weak signals."""
+        if self.connect_ms.n:
+            timeout = 3 * self.connect_ms.total // self.connect_ms.n
+        else:
+            timeout = _CONNECT_TIMEOUT_FIRST
+        if rssi is not None and rssi < WEAK_RSSI:
+            timeout *= 2
+        return min(max(timeout, _CONNECT_TIMEOUT_MIN), _CONNECT_TIMEOUT_MAX)
+
+    def backoff_ms(self, attempt):
+        """Randomized exponential wait before the next attempt, longer while attempts fail often."""
+        base = _BACKOFF_BASE << min(attempt, 4)
+        if self.failure_rate > 50:
+            base *= 2
+        base = min(base, _BACKOFF_MAX)
+        return base // 2 + random.getrandbits(16) % (base // 2 + 1)
+
+    def holdoff_ms(self):
+        """Remaining time in which a device that failed is not tried again (0: try)."""
+        if not self.failures_in_row:
+            return 0
+        holdoff = min(_HOLDOFF << min(self.failures_in_row - 1, 5), _HOLDOFF_MAX)
+        return max(0, holdoff - time.ticks_diff(time.ticks_ms(), self._failed_at))
+
+    def reply_timeout_ms(self, limit):
+        """How long to wait for a notification before a command is sent again."""
+        if not self.reply_ms.n:
+            return limit
+        return min(max(4 * self.reply_ms.total // self.reply_ms.n, _REPLY_TIMEOUT_MIN), limit)
+
+    def replied(self, ms):
+        self.requests += 1
+        if ms is None:
+            self.timeouts += 1
+        else:
+            self.reply_ms.add(ms)
+
+    def compact(self):
+        """Short keys for the metrics topic."""
+        return {
+            "con": [self.connects, self.connect_failures, self.attempts, self.failure_rate, self.failures_in_row],
+            "con_ms": self.connect_ms.compact(),
+            "req": [self.requests, self.timeouts, self.retries],
+            "rep_ms": self.reply_ms.compact(),
+        }
+
+
+def _match(data, prefix):
+    """Check the prefix of a notification without slicing (no allocation)."""
+    if len(data) < len(prefix):
+        return False
+    for i in range(len(prefix)):
+        if data[i] != prefix[i]:
+            return False
+    return True
+
+
+class Registry:
+    """EQ3 thermostats seen in advertisements, indexed by address."""
+
+    def __init__(self):
+        self._devices = {}  # Address bytes -> [MAC, last seen ticks_ms, smoothed RSSI, advertising data]
+
+    def __len__(self):
+        return len(self._devices)
+
+    def seen(self, addr, rssi, adv_data):
+        """Record an advertisement, return the entry or None if it is no thermostat (prefix 00:1A:22)."""
+        if addr[0] != 0x00 or addr[1] != 0x1A or addr[2] != 0x22:
+            return None
+        key = bytes(addr)
+        entry = self._devices.get(key)
+        if entry is None:
+            # Format the MAC only once per device
+            entry = [":".join(["{:02X}".format(b) for b in key]), 0, rssi, b'']
+            self._devices[key] = entry
+            print(f"Found Eqiva thermostat: {entry[0]}, RSSI: {rssi} dB")
+        entry[1] = time.ticks_ms()
+        entry[2] = (3 * entry[2] + rssi) // 4  # Single advertisements vary by several dB
+        entry[3] = bytes(adv_data)
+        return entry
+
+    def _entry(self, mac):
+        return self._devices.get(ubinascii.unhexlify(mac.replace(':', '')))
+
+    def age(self, mac):
+        """Seconds since the last advertisement of a MAC, None if it was never seen."""
+        entry = self._entry(mac)
+        if entry is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), entry[1]) // 1000
+
+    def rssi(self, mac):
+        entry = self._entry(mac)
+        return entry[2] if entry is not None else None
+
+    def in_range(self, mac, max_age=60):
+        """True if the thermostat advertised within max_age seconds."""
+        age = self.age(mac)
+        return age is not None and age <= max_age
+
+    def macs(self, max_age=None):
+        now = time.ticks_ms()
+        return [entry[0] for entry in self._devices.values()
+                if max_age is None or time.ticks_diff(now, entry[1]) <= max_age * 1000]
+
+    def to_dict(self):
+        """MAC -> {"rssi": smoothed RSSI, "age": s since last seen, "adv": advertising data (hex)}"""
+        now = time.ticks_ms()
+        return {entry[0]: {"rssi": entry[2], "age": time.ticks_diff(now, entry[1]) // 1000,
+                           "adv": ubinascii.hexlify(entry[3]).decode()}
+                for entry in self._devices.values()}
+
+
+def scan_result(found_devices, data, registry):
+    """Record an advertisement (_IRQ_SCAN_RESULT) in the registry, add thermostats to the found set."""
+    addr_type, addr, adv_type, rssi, adv_data = data
+    entry = registry.seen(addr, rssi, adv_data)
+    if entry is not None:
+        found_devices.add(entry[0])
 
 
 class Eqiva:
-    def __init__(self, utc_offset=1):
-        self.ble = bluetooth.BLE()
-        self.ble.active(False)  # Reset BLE
-        time.sleep(0.1)
-        self.ble.active(True)
-        self.ble.irq(self._irq_handler)
+    def __init__(self, utc_offset=1, timeout=2, ble=None, transport=None, write_response=True):
+        """transport: BLE backend with the bluetooth.BLE interface (active, irq, gap_connect,
+        gap_disconnect, gap_scan, gattc_write), default bluetooth.BLE(), see simulator.SimBLE.
+        ble: BLE shared with an EqivaManager, which dispatches the events.
+        write_response: False writes without response (one ATT round trip less), the notification
+        confirms the command and it is sent again if the notification is missing."""
+        if ble is None:
+            self.ble = transport if transport is not None else bluetooth.BLE()
+            if self.ble.active():
+                self.ble.active(False)  # Reset a stack left running by a soft reset, cold boots skip this
+                time.sleep(0.1)
+            self.ble.active(True)
+            self.ble.irq(self._irq_handler)
+        else:
+            # Shared BLE, the owner dispatches the events to _irq_handler
+            self.ble = ble
         self.addr = None
         self.conn_handle = None
         self.is_connected = False
-        self._notification_data = None
-        self.status = None
-        self.parse_status = True
+        self._ring = [bytearray(_RING_SLOT_SIZE) for _ in range(_RING_SLOTS)]
+        self._ring_len = bytearray(_RING_SLOTS)
+        self._ring_head = 0  # Next slot written by the IRQ
+        self._ring_tail = 0  # Next slot decoded by _process
+        self._scheduled = False
+        self._processing = False  # _process is running
+        self._process_ref = self._process  # Bound once, schedule() must not allocate in the IRQ
+        self.dropped = 0  # Notifications lost because the ring was full
+        self._expect = None  # Prefix of the reply a pending request waits for
+        self._response = None
+        self.status = Status()  # Last decoded status, reused for every notification
+        self._week = {}  # Day index -> (last read / written timer payload (bytes 2-15), ticks_ms)
+        self.week_ttl = 3600  # s, older cached days count as unknown (changed in the app or at the thermostat)
         self.utc_offset = utc_offset
+        self.timeout_ms = int(timeout * 1000)  # Max time to wait for a reply
+        self._enc = Encoder()  # Command buffers of this device
+        self.write_response = write_response
+        self.on_update = None  # Called with (kind, value) for every decoded status / info / timer
+        self.metrics = Metrics()  # Of the current thermostat
+        self._metrics = {}  # Address -> Metrics, one Eqiva may be used for several thermostats
+        self.registry = Registry()  # Thermostats seen by the scans
+
+    def _set_addr(self, addr):
+        """Switch to the cached schedule and the connect history of the thermostat at addr."""
+        if addr == self.addr:
+            return
+        self._week = {}
+        if self.addr is None:
+            self._metrics[addr] = self.metrics  # Nothing connected yet, keep the record
+        metrics = self._metrics.get(addr)
+        if metrics is None:
+            metrics = self._metrics[addr] = Metrics()
+        self.metrics = metrics
+        self.addr = addr
 
     def _addr_to_bytes(self, addr_str):
         """Convert string MAC address to bytes."""
@@ -49,70 +434,10 @@ class Eqiva:
         return bytes.fromhex(addr)
 
     def _parse_status(self, data):
-        """Parse status response from Eqiva."""
-        if not data or len(data) < 6:
-            # if not data or len(data) not in (3, 6, 10, 15, 16):
-            return "Invalid data received"
-
-        status = {}
-
-        # Convert bytes to list of integers for easier handling
-        bytes_data = list(data)
-
-        # Parse mode from first byte
-        mode_byte = bytes_data[2]
-        mode_flags = {
-            0x01: "manual",
-            0x02: "vacation",
-            0x04: "boost",
-            0x08: "dst",
-            0x10: "open window",
-            0x20: "locked",
-            0x40: "unknown",
-            0x80: "battery_low"
-        }
-
-        status["modes"] = []
-        if not (mode_byte & 0x01):  # If bit 1 is not set
-            status["modes"].append("auto")
-
-        # Check each flag
-        for flag, mode in mode_flags.items():
-            if mode_byte & flag:
-                status["modes"].append(mode)
-
-        # Parse temperature (byte 5)
-        temp = bytes_data[5] / 2
-        status["temperature"] = temp
-
-        # Parse valve position (byte 3)
-        status["valve"] = bytes_data[3]
-
-        # If vacation mode is active (bytes 7-9)
-        if "vacation" in status["modes"] and len(bytes_data) > 10:
-            status["vacation"] = {
-                "day": bytes_data[6],
-                "month": bytes_data[9],
-                "year": bytes_data[7] + 2000,
-                "time": [(bytes_data[8] * 30) // 60, (bytes_data[8] * 30) % 60]  # Hour, Min from 30 min counter
-            }
-
-        # Parse extended data if available (bytes 10-14)
-        if len(bytes_data) > 14:
-            # Temperature in open windows mode (byte 10)
-            status["window_open_temp"] = bytes_data[10] / 2
-
-            # Open windows interval (byte 11)
-            status["window_open_time"] = bytes_data[11] * 5  # in minutes
-
-            # Comfort and eco temperatures (bytes 12-13)
-            status["comfort_temp"] = bytes_data[12] / 2
-            status["eco_temp"] = bytes_data[13] / 2
-
-            # Temperature offset (byte 14)
-            status["temp_offset"] = (bytes_data[14] - 7) / 2
-
-        return status
+        """Decode a status response into the reusable status record."""
+        if not self.status.decode(data):
+            return None
+        return self.status
 
     def _irq_handler(self, event, data):
         """Handle BLE events."""
@@ -129,17 +454,117 @@ class Eqiva:
             print("Disconnected")
 
         elif event == _IRQ_GATTC_NOTIFY:
+            # Only copy the payload, decoding and logging run later in _process
             conn_handle, value_handle, notify_data = data
-            print("Raw data:", ubinascii.hexlify(notify_data))
-            if self.parse_status:
-                self.status = self._parse_status(notify_data)
-                print("Status:", self.status)
-            self.parse_status = True
-            self._notification_data = notify_data
+            head = self._ring_head
+            nxt = (head + 1) % _RING_SLOTS
+            if nxt == self._ring_tail:
+                self.dropped += 1
+                return
+
+            buf = self._ring[head]
+            n = min(len(notify_data), _RING_SLOT_SIZE)
+            for i in range(n):
+                buf[i] = notify_data[i]
+            self._ring_len[head] = n
+            self._ring_head = nxt
+
+            if not self._scheduled:
+                try:
+                    schedule(self._process_ref, None)
+                    self._scheduled = True
+                except RuntimeError:
+                    pass  # Scheduler queue full, the next notification or the waiter retries
+
+    def _process(self, _=None):
+        """Decode all queued notifications (runs outside of the BLE IRQ).
+
+        Called by the scheduler and by the waiting request. A scheduled call can interrupt the
+        waiter's call between two bytecodes, it returns right away and the running call drains
+        the new slots as well.
+        """
+        self._scheduled = False
+        if self._processing:
+            return
+        self._processing = True
+        try:
+            while self._ring_tail != self._ring_head:
+                tail = self._ring_tail
+                self._on_notify(memoryview(self._ring[tail])[:self._ring_len[tail]])
+                self._ring_tail = (tail + 1) % _RING_SLOTS
+        finally:
+            self._processing = False
+
+    def _on_notify(self, data):
+        """Handle one notification: log, decode the status and hand replies to the waiting request."""
+        if DEBUG:
+            print("Raw data:", ubinascii.hexlify(data))
+        if _match(data, REPLY_STATUS) and self._parse_status(data):
+            if DEBUG:
+                print("Status:", self.status.to_dict())
+            self._update('status', self.status)
+
+        # Wake up the pending request if this is the reply it waits for
+        if self._expect is not None and _match(data, self._expect):
+            self._response = bytes(data)
+
+    def _update(self, kind, value):
+        """Pass decoded data to the on_update listener ('status', 'info', 'timer/<DAY>' or 'reset').
+
+        The status is passed as the reused Status record.
+        """
+        if self.on_update:
+            self.on_update(kind, value)
+
+    def _request(self, command, expect):
+        """Write a command and wait until the matching notification arrives."""
+        if self.write_response:
+            attempts, wait_ms = 1, self.timeout_ms
+        else:
+            attempts, wait_ms = 1 + WRITE_RETRIES, self.metrics.reply_timeout_ms(self.timeout_ms)
+        self._expect = expect
+        self._response = None
+        start = time.ticks_ms()
+
+        for attempt in range(attempts):
+            if attempt:
+                print("No reply, sending again")
+                self.metrics.retries += 1
+            self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1 if self.write_response else 0)
+
+            # Return as soon as the reply is there, give up after the timeout
+            sent = time.ticks_ms()
+            while self._response is None and time.ticks_diff(time.ticks_ms(), sent) < wait_ms:
+                time.sleep_ms(_POLL_MS)
+                self._process()  # In case the scheduler queue was full
+            if self._response is not None:
+                break
+
+        self._expect = None
+        self.metrics.replied(time.ticks_diff(time.ticks_ms(), start) if self._response is not None else None)
+        return self._response
+
+    def _status_request(self, command):
+        """Write a command that is answered with a status notification."""
+        data = self._request(command, REPLY_STATUS)
+        if data is None or len(data) < 6:
+            raise Exception("Failed to read status")
+        return self.status.to_dict()
 
     def connect(self, addr_str, max_retries=3):
-        """Connect to Eqiva thermostat with retries."""
-        self.addr = self._addr_to_bytes(addr_str)
+        """Connect to Eqiva thermostat with retries.
+
+        Timeouts and waits between the attempts follow the device's history (see Metrics).
+        """
+        self._set_addr(self._addr_to_bytes(addr_str))
+
+        # Do not block on a device that just failed (e.g. empty battery)
+        holdoff = self.metrics.holdoff_ms()
+        if holdoff:
+            raise Exception(f"Device unreachable, next try in {holdoff // 1000} s")
+        timeout_ms = self.metrics.connect_timeout_ms(self.registry.rssi(addr_str))
+        if self.metrics.failures_in_row:
+            max_retries = 1  # Probe only, the last connect() failed
 
         for attempt in range(max_retries):
             print(f"Connection attempt {attempt + 1}/{max_retries}")
@@ -155,28 +580,42 @@ class Eqiva:
                     time.sleep(0.1)
 
                 print("Connecting to", addr_str)
+                start = time.ticks_ms()
                 self.ble.gap_connect(0, self.addr)
 
-                # Wait for connection
-                timeout = 10
-                while timeout > 0 and not self.is_connected:
-                    time.sleep(1)
-                    timeout -= 1
+                # Wait for the connect event
+                while not self.is_connected and time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+                    time.sleep_ms(_POLL_MS * 4)
 
                 if self.is_connected:
                     print("Connection successful")
+                    self.metrics.attempt(time.ticks_diff(time.ticks_ms(), start))
                     return True
 
+                print("Connection attempt timed out")
+                self._cancel_connect()
+
             except Exception as e:
                 print(f"Connection attempt failed: {e}")
 
+            self.metrics.attempt(None)
+
             # Wait before retry
-            if not self.is_connected and attempt < max_retries - 1:
-                print("Waiting before retry...")
-                time.sleep(2)
+            if attempt < max_retries - 1:
+                backoff = self.metrics.backoff_ms(attempt)
+                print(f"Waiting {backoff} ms before retry...")
+                time.sleep_ms(backoff)
 
+        self.metrics.connect_failed()
         raise Exception("Failed to connect after all retries")
 
+    def _cancel_connect(self):
+        """Cancel a pending gap_connect."""
+        try:
+            self.ble.gap_connect(None)
+        except OSError:
+            pass  # Nothing pending
+
     def disconnect(self):
         """Disconnect from thermostat."""
         if self.conn_handle is not None:
@@ -187,19 +626,11 @@ class Eqiva:
 
     def scan(self, timeout=10):
         """Scan for Eqiva thermostats."""
-        found_devices = []
+        found_devices = set()
 
         def _irq_handler_scan(event, data):
             if event == _IRQ_SCAN_RESULT:
-                addr_type, addr, adv_type, rssi, adv_data = data
-                # Convert address to string format
-                addr_string = ":".join(["{:02X}".format(b) for b in addr])
-
-                # Check if it starts with EQ3's prefix (00:1A:22)
-                if addr_string.startswith("00:1A:22"):
-                    if addr_string not in found_devices:
-                        found_devices.append(addr_string)
-                        print(f"Found Eqiva thermostat: {addr_string}, RSSI: {rssi} dB")
+                scan_result(found_devices, data, self.registry)
 
             elif event == _IRQ_SCAN_DONE:
                 print("Scan complete")
@@ -219,23 +650,67 @@ class Eqiva:
             # Restore the original handler
             self.ble.irq(self._irq_handler)
 
-        return found_devices
+        return list(found_devices)
 
-    def get_serial(self):
-        """Read the serial number, firmware version and PIN."""
-        self.parse_status = False
-        command = bytearray([0x00])
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
+    # Command encoding (shared with the async client), see eq3codec.Encoder
+
+    def _cmd_status(self):
+        """Build a status request, which also sets the current time."""
+        return self._enc.status(time.localtime(), self.utc_offset)
 
-        if not self._notification_data or len(self._notification_data) < 15:
+    def _cmd_mode(self, mode, temp=-1.0, day=0, month=0, year=0, t=(0, 0)):
+        """Build a mode command (MANUAL, AUTO, VACATION)."""
+        if temp != -1.0:
+            # Vacation only
+            return self._enc.vacation(temp, day, month, year, t[0], t[1])
+        return self._enc.mode(mode)
+
+    def _cmd_temp(self, temp, mode=-1):
+        """Build a temperature / comfort / eco / boost command."""
+        if mode != -1:
+            # Comfort / Eco
+            if 0x42 < mode < 0x45:
+                return self._enc.preset(mode)
+            # Boost
+            return self._enc.boost(mode)
+        return self._enc.temp(temp)
+
+    def _cmd_get_timer(self, day):
+        """Build a read timer command (0x20, followed by day)."""
+        return self._enc.get_timer(day)
+
+    def _cmd_set_timer(self, day, temps_times):
+        """Build a set timer command."""
+        return self._enc.set_timer(day, temps_times)
+
+    def _cmd_comfort_eco(self, comfort_temp, eco_temp):
+        """Build a comfort and eco temperature configuration command."""
+        return self._enc.comfort_eco(comfort_temp, eco_temp)
+
+    def _cmd_window_open(self, temp, duration):
+        """Build a window open configuration command."""
+        return self._enc.window_open(temp, duration)
+
+    def _cmd_offset(self, offset):
+        """Build a temperature offset command."""
+        return self._enc.offset(offset)
+
+    def _cmd_lock(self, lock):
+        """Build a lock / unlock command."""
+        return self._enc.lock(lock)
+
+    # Reply decoding (shared with the async client)
+
+    def _parse_serial(self, data):
+        """Parse serial number, firmware version and PIN from a 0x01 reply."""
+        if not data or len(data) < 15:
             raise Exception("Failed to read serial number")
 
         # Get firmware version from byte 1
-        firmware = self._notification_data[1] / 100.0
+        firmware = data[1] / 100.0
 
         # Serial starts at byte 4, length 10 bytes
-        serial_bytes = self._notification_data[4:14]
+        serial_bytes = data[4:14]
 
         # Convert each byte by subtracting 0x30
         serial = ''.join(chr(b - 0x30) for b in serial_bytes)
@@ -249,236 +724,135 @@ class Eqiva:
 
         return [serial, firmware, pin]
 
-    def get_status(self):
-        """Request a status update from the thermostat."""
-        # Get current time for status request
-        current_time = time.localtime()
-        command = bytearray([
-            0x03,  # Status request command
-            current_time[0] - 2000,  # Year (relative to 2000)
-            current_time[1],  # Month
-            current_time[2],  # Day
-            current_time[3] + self.utc_offset,  # Hour
-            current_time[4],  # Minute
-            current_time[5]  # Second
-        ])
-
-        # Write command and wait for notification
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-        if not self.status:
-            raise Exception("Failed to read status")
-        return self.status
-
-    def set_mode(self, mode, temp=-1.0, day=0, month=0, year=0, t=(0, 0)):
-        """Switch mode (MANUAL, AUTO, VACATION)."""
-        if temp != -1.0:
-            # Vacation only
-            if not 4.5 <= temp <= 30:
-                raise ValueError("Temperature must be between 4.5°C and 30°C")
-
-            command = bytearray([
-                0x40,
-                int(temp * 2) + 128,
-                day,
-                year - 2000,
-                int(((t[0] * 60) + t[1]) / 30),  # 30 minute steps
-                month,
-            ])
-        else:
-            command = bytearray([0x40, mode])
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-        if not self.status:
-            raise Exception("Failed to read status")
-        return self.status
+    def _parse_timer(self, data):
+        """Parse the timer events of a day from a 0x21 reply."""
+        return decode_timer(data)
 
-    def set_temp(self, temp, mode=-1):
-        """Set target temperature / boost (ON / OFF)."""
-        if mode != -1:
-            # Comfort / Eco
-            if 0x42 < mode < 0x45:
-                command = bytearray([mode])
-            # Boost
-            else:
-                command = bytearray([
-                        0x45,
-                        mode
-                ])
-        else:
-            if not 4.5 <= temp <= 30:
-                raise ValueError("Temperature must be between 4.5°C and 30°C")
+    def _parse_timer_ack(self, data):
+        """Parse the day from a set timer acknowledgement."""
+        if not data or len(data) != 3:
+            raise Exception("Failed to read data")
 
-            command = bytearray([
-                0x41,
-                int(temp * 2)
-            ])
+        data = list(data)
+        print("Day: ", data[2])
+        return data[2]
 
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-        if not self.status:
-            raise Exception("Failed to read status")
-        return self.status
+    def _parse_reset_ack(self, data):
+        """Parse the result of a factory reset."""
+        if not data or len(data) != 3:
+            raise Exception("Failed to read data")
 
-    def get_timer(self, day):
-        """Read timer of a specific day."""
-        if day.upper() not in DAYS:
-            raise ValueError("Not a valid day")
+        data = list(data)
+        if data[1] == 0:
+            print("Performing a factory reset...")
+        return data[1]
 
-        # Command 0x20 for read timer, followed by day
-        self.parse_status = False
-        command = bytearray([0x20, DAYS.index(day.upper())])
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
+    def _week_put(self, index, payload):
+        self._week[index] = (payload, time.ticks_ms())
 
-        # Wait for notification with timer data
-        time.sleep(1)
+    def _week_get(self, index):
+        """Cached timer payload of a day index, None if unknown or older than week_ttl."""
+        entry = self._week.get(index)
+        if entry is None or time.ticks_diff(time.ticks_ms(), entry[1]) >= self.week_ttl * 1000:
+            return None
+        return entry[0]
 
-        if not self._notification_data or len(self._notification_data) < 16:
-            raise Exception("Failed to read timer data")
+    def _week_cached(self):
+        """True if the schedule of every day is cached and fresh."""
+        for index in range(len(DAYS)):
+            if self._week_get(index) is None:
+                return False
+        return True
 
-        data = list(self._notification_data)
+    def _week_changed(self, day, temps_times):
+        """Check whether a day's encoded timer differs from the cached schedule (stale days always do)."""
+        command = self._cmd_set_timer(day, temps_times)
+        return self._week_get(command[1]) != bytes(command[2:])
 
-        # Parse the timer data
-        events = []
+    def _week_from_cache(self, index=None):
+        """Decode the cached schedule of all days (or the events of one day index)."""
+        if index is not None:
+            return self._parse_timer(TIMER_REPLY[index] + self._week[index][0])
+        return {day: self._week_from_cache(i) for i, day in enumerate(DAYS)}
 
-        # First temperature (midnight to first event)
-        initial_temp = data[2] / 2.0
-        events.append((initial_temp, None))
+    # Commands
 
-        # Parse remaining events
-        for i in range(0, 7):  # Max 7 events
-            time_byte = data[3 + i * 2]
-            temp_byte = data[4 + i * 2]
+    def get_serial(self):
+        """Read the serial number, firmware version and PIN."""
+        info = self._parse_serial(self._request(self._enc.serial(), REPLY_SERIAL))
+        self._update('info', info)
+        return info
 
-            if time_byte == 0 and temp_byte == 0:
-                break
+    def get_status(self):
+        """Request a status update from the thermostat."""
+        # Write command and wait for notification
+        return self._status_request(self._cmd_status())
 
-            # Convert time value to hours and minutes
-            hours = time_byte // 6
-            minutes = (time_byte % 6) * 10
-            temp = temp_byte / 2.0
+    def set_mode(self, mode, temp=-1.0, day=0, month=0, year=0, t=(0, 0)):
+        """Switch mode (MANUAL, AUTO, VACATION)."""
+        return self._status_request(self._cmd_mode(mode, temp, day, month, year, t))
 
-            events.append((temp, f"{hours:02d}:{minutes:02d}"))
+    def set_temp(self, temp, mode=-1):
+        """Set target temperature / boost (ON / OFF)."""
+        return self._status_request(self._cmd_temp(temp, mode))
 
+    def get_timer(self, day):
+        """Read timer of a specific day."""
+        command = self._cmd_get_timer(day)
+        index = command[1]
+
+        # Wait for notification with timer data of that day
+        data = self._request(command, TIMER_REPLY[index])
+        events = self._parse_timer(data)
+        self._week_put(index, data[2:16])
+        self._update('timer/' + DAYS[index], events)
         return events
 
     def set_timer(self, day, temps_times):
         """Set timer for a specific day."""
-        if day.upper() not in DAYS:
-            raise ValueError("Not a valid day")
-
-        # Command start (0x10 for set timer, followed by day)
-        command = bytearray([0x10, DAYS.index(day.upper())])
-
-        # Add initial midnight temperature
-        first_temp = temps_times[0][0]
-        command.append(int(first_temp * 2))
-
-        # Add each event's time and following temperature
-        for i in range(1, len(temps_times)):
-            temp, hour, minute = temps_times[i]
-
-            # Convert time to 10-minute intervals
-            time_value = (hour * 6) + (minute // 10)
-            command.append(time_value)
-
-            # Add temperature for period after this event
-            command.append(int(temp * 2))
-
-        # Ensure that last time is 24:00
-        if len(command) < 16:
-            command.append(24 * 6)
-        else:
-            command[15] = 24 * 6
-
-        # Pad remaining slots with zeros up to 16 bytes total
-        while len(command) < 16:
-            command.append(0)
-
-        self.parse_status = False
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-
-        if not self._notification_data or len(self._notification_data) != 3:
-            raise Exception("Failed to read data")
-
-        data = list(self._notification_data)
-        print("Day: ", data[2])
-        return data[2]
+        command = self._cmd_set_timer(day, temps_times)
+        index, payload = command[1], bytes(command[2:])
+        res = self._parse_timer_ack(self._request(command, REPLY_TIMER_SET))
+        self._week_put(index, payload)
+        self._update('timer/' + DAYS[index], self._week_from_cache(index))
+        return res
+
+    def get_week(self, cached=False):
+        """Read the timers of all days. With cached=True the last read / written schedule is used if
+        complete and not older than week_ttl."""
+        if not cached or not self._week_cached():
+            for day in DAYS:
+                self.get_timer(day)
+        return self._week_from_cache()
+
+    def set_week(self, schedule):
+        """Set the timers of several days {day: temps_times}. Only days that differ from the cache are
+        sent, days cached longer than week_ttl ago are always sent."""
+        written = []
+        for day, temps_times in schedule.items():
+            if self._week_changed(day, temps_times):
+                self.set_timer(day, temps_times)
+                written.append(day.upper())
+        return written
 
     def conf_comfort_eco(self, comfort_temp, eco_temp):
         """Configure comfort and eco temperatures."""
-        if not 5.0 <= comfort_temp <= 30.0 or not 5.0 <= eco_temp <= 30.0:
-            raise ValueError("Temperature must be between 5°C and 30°C")
-
-        command = bytearray([
-            0x11,  # Command for comfort/eco config
-            int(comfort_temp * 2),  # Comfort temperature
-            int(eco_temp * 2)  # Eco temperature
-        ])
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-        if not self.status:
-            raise Exception("Failed to read status")
-        return self.status
+        return self._status_request(self._cmd_comfort_eco(comfort_temp, eco_temp))
 
     def conf_window_open(self, temp, duration):
         """Configure window open mode."""
-        if not 5.0 <= temp <= 30.0:
-            raise ValueError("Temperature must be between 5°C and 30°C")
-        if duration % 5 != 0:
-            raise ValueError("Duration must be a multiple of 5 minutes")
-        if not 0 <= duration <= 150:  # Based on API examples
-            raise ValueError("Duration must be between 0 and 150 minutes")
-
-        command = bytearray([
-            0x14,  # Command for window open config
-            int(temp * 2),  # Temperature in 0.5°C steps
-            duration // 5  # Duration in 5-minute steps
-        ])
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-        if not self.status:
-            raise Exception("Failed to read status")
-        return self.status
+        return self._status_request(self._cmd_window_open(temp, duration))
 
     def conf_offset(self, offset):
         """Set temperature offset."""
-        if not -3.5 <= offset <= 3.5:
-            raise ValueError("Offset must be between -3.5°C and 3.5°C")
-
-        if abs(offset * 2) % 1 != 0:
-            raise ValueError("Offset must be in 0.5°C steps")
-
-        command = bytearray([0x13, int((offset + 3.5) * 2)])  # Convert offset to encoded value
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-        if not self.status:
-            raise Exception("Failed to read status")
-        return self.status
+        return self._status_request(self._cmd_offset(offset))
 
     def set_lock(self, lock):
         """Lock the thermostat."""
-        if lock:
-            command = bytearray([0x80, 0x01])
-        else:
-            command = bytearray([0x80, 0x00])
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-        if not self.status:
-            raise Exception("Failed to read status")
-        return self.status
+        return self._status_request(self._cmd_lock(lock))
 
     def factory_reset(self):
         """Perform a factory rest."""
-        command = bytearray([0xF0])
-        self.ble.gattc_write(self.conn_handle, HANDLE_WRITE, command, 1)
-        time.sleep(1)
-
-        if not self._notification_data or len(self._notification_data) != 3:
-            raise Exception("Failed to read data")
-
-        data = list(self._notification_data)
-        if data[1] == 0:
-            print("Performing a factory reset...")
-        return data[1]
+        self._week = {}
+        self._update('reset', None)
+        return self._parse_reset_ack(self._request(self._enc.factory_reset(), REPLY_ACK))
@@ -0,0 +1,23 @@
+# Frozen module manifest: builds the Eqiva modules and the MQTT gateway into the firmware
+# v0.2 (c) Copyright prefixFelix 2025
+#
+#   $ cd micropython/ports/esp32
+#   $ make BOARD=ESP32_GENERIC FROZEN_MANIFEST=/path/to/this/manifest.py
+# Then copy only mqtt-gateway/config.py and mqtt-gateway/main.py onto the board.
+# Frozen modules run from flash: importing them costs no compile time and almost no heap.
+
+include("$(PORT_DIR)/boards/manifest.py")  # The board's default modules (ntptime, ...)
+require("umqtt.simple")
+
+module("eq3codec.py")
+module("eqiva.py")
+module("aeqiva.py")
+
+module("cmdqueue.py", base_path="mqtt-gateway")
+module("journal.py", base_path="mqtt-gateway")
+module("mqttlink.py", base_path="mqtt-gateway")
+module("poller.py", base_path="mqtt-gateway")
+module("pool.py", base_path="mqtt-gateway")
+module("shadow.py", base_path="mqtt-gateway")
+module("state.py", base_path="mqtt-gateway")
+module("gateway.py", base_path="mqtt-gateway")
@@ -0,0 +1,86 @@
+# Bounded priority queue for the Eqiva MQTT gateway (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import asyncio
+
+# Priorities, lower numbers are served first
+PRIO_SET = 0  # User changes: setpoints, modes, configuration
+PRIO_GET = 1  # Reads and batches
+PRIO_BULK = 2  # Scans, several thermostats at once, week syncs, resets
+PRIO_POLL = 3  # Background status reads of the poller
+
+
+class CommandQueue:
+    """One FIFO per priority with a common size limit. put() never blocks.
+
+    Items are sequences starting with a key, take() fetches the next item of a key.
+    """
+
+    def __init__(self, max_size=16, levels=4):
+        self.max_size = max_size
+        self._queues = [[] for _ in range(levels)]
+        self._len = 0
+        self._event = asyncio.Event()
+        self.peak = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return self._len
+
+    def put(self, prio, item):
+        """Enqueue an item, False if the queue is full."""
+        if self._len >= self.max_size:
+            self.rejected += 1
+            return False
+        self._queues[prio].append(item)
+        self._len += 1
+        if self._len > self.peak:
+            self.peak = self._len
+        self._event.set()
+        return True
+
+    async def get(self):
+        """Wait for the next item with the highest priority."""
+        while not self._len:
+            self._event.clear()
+            await self._event.wait()
+        for queue in self._queues:
+            if queue:
+                self._len -= 1
+                return queue.pop(0)
+
+    def take(self, key):
+        """Remove and return the next item of key (highest priority first), None if there is none."""
+        for queue in self._queues:
+            for i in range(len(queue)):
+                if queue[i][0] == key:
+                    self._len -= 1
+                    return queue.pop(i)
+        return None
+
+    def has(self, key):
+        """True if an item of key is queued at any priority."""
+        for queue in self._queues:
+            for item in queue:
+                if item[0] == key:
+                    return True
+        return False
+
+    def level(self, key, last):
+        """Lowest priority (highest number, at most last) with an item of key queued, -1 if none."""
+        for prio in range(last, -1, -1):
+            for item in self._queues[prio]:
+                if item[0] == key:
+                    return prio
+        return -1
+
+    def last(self, prio, key):
+        """Most recently queued item of key with priority prio (still queued, may be modified), or None."""
+        queue = self._queues[prio]
+        for i in range(len(queue) - 1, -1, -1):
+            if queue[i][0] == key:
+                return queue[i]
+        return None
+
+    def stats(self):
+        return {"queued": self._len, "peak": self.peak, "rejected": self.rejected}
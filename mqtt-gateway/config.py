@@ -1,5 +1,6 @@
 SSID = ''
 PASSWD = ''
+WIFI_TIMEOUT = 20  # s, connect again if the access point did not answer
 
 DEVICE_NAME = ''
 MQTT_CLIENT_ID = b''
@@ -7,3 +8,43 @@ MQTT_SERVER = b''
 MQTT_PORT = 0
 MQTT_USER = b''
 MQTT_PASSWD = b''
+MQTT_TLS = True
+MQTT_CA = ''  # CA certificate of the broker on flash (PEM / DER file, e.g. 'ca.pem'), '' = not verified
+MQTT_BACKOFF_MIN = 1  # s, wait before reconnecting to the broker, doubles up to MQTT_BACKOFF_MAX
+MQTT_BACKOFF_MAX = 300
+
+WRITE_RESPONSE = True  # False: write without response (experimental), the thermostat's notification confirms commands
+MAX_CONNECTIONS = 4  # Concurrent thermostat connections (NimBLE limit)
+POOL_SIZE = 3  # Connections kept open for reuse
+POOL_IDLE_TIMEOUT = 30  # Close pooled connections after s without commands
+
+BACKGROUND_SCAN = True  # Keep a registry of thermostats in range, radin/scan answers from it
+SCAN_INTERVAL_US = 640000  # Background scan: listen SCAN_WINDOW_US every SCAN_INTERVAL_US (7.5 %)
+SCAN_WINDOW_US = 48000
+SEEN_MAX_AGE = 300  # s, thermostats the background scan did not hear for longer fail without connecting
+
+QUEUE_SIZE = 16  # Queued messages, further ones are answered with {"error": "busy"}
+
+STATUS_FORMAT = 'json'  # radout/<mac>/status: 'json' or 'bin' (14 bytes, see eqiva.Status.pack)
+STATUS_DELTA = False  # Also publish the changed fields only on radout/<mac>/delta
+
+POLL_INTERVAL = 300  # s, status read of every known thermostat, spread over the interval (0 = off)
+POLL_FAST_INTERVAL = 60  # s, while boost or open window is active
+POLL_MAX_INTERVAL = 1800  # s, the interval grows up to this while the status does not change
+POLL_MACS = []  # Thermostats to poll from the start, commanded ones are added automatically
+
+STATE_TTL_STATUS = 300  # s, cached status (answers requests with "max_age")
+STATE_TTL_INFO = 86400  # s, cached serial / firmware / pin
+STATE_TTL_TIMER = 3600  # s, cached timers, older days are written again by "week" even if unchanged
+
+SHADOW = True  # Set commands are only sent if the thermostat differs, failed ones are retried in the background
+SHADOW_STATUS_AGE = 300  # s, a cached status younger than this decides whether a set command is needed
+SHADOW_RETRY = 30  # s until a setting that did not arrive is sent again, doubling up to SHADOW_RETRY_MAX
+SHADOW_RETRY_MAX = 600
+SHADOW_EXPIRE = 3600  # s, settings that could not be written for this long are given up
+
+JOURNAL_PATH = 'journal.bin'  # Messages the broker did not get and queued commands survive outages / resets
+JOURNAL_MAX = 32768  # B of flash for the journal, the oldest messages are dropped beyond (0 = off)
+JOURNAL_FLUSH = 30  # s between journal writes (batched to spare the flash)
+
+METRICS_INTERVAL = 60  # s between radout/metrics messages, 0 disables them
@@ -1,200 +1,758 @@
 # Simple Eqiva radiator thermostat module (MicroPython)
 # v0.2 (c) Copyright prefixFelix 2025
 
-import ntptime
-import network
 import time
-from umqtt.simple import MQTTClient
-import ssl
+_boot = time.ticks_ms()  # ms since reset when the gateway started
+import asyncio
 import config
 import eqiva
+import aeqiva
 import json
+import gc
+from pool import ConnectionPool
+from state import StateCache
+from cmdqueue import CommandQueue, PRIO_SET, PRIO_GET, PRIO_BULK, PRIO_POLL
+from poller import Poller
+from mqttlink import MQTTLink
+from journal import Journal
+from shadow import Shadow
 
 
-def wifi_connect():
+# Commands that are answered with the thermostat status
+STATUS_CMDS = ('status', 'mode', 'temp', 'comfort_eco', 'window_open', 'offset', 'lock')
+# Commands that change a thermostat on user request, queued ahead of reads and bulk work
+SET_CMDS = ('mode', 'temp', 'comfort_eco', 'window_open', 'offset', 'lock', 'set_timer')
+# Queued commands of these kinds are replaced by a newer one to the same thermostat
+COALESCE_CMDS = ('mode', 'temp', 'comfort_eco', 'window_open', 'offset', 'lock')
+# Equal queued reads run once and share the result
+SHARED_CMDS = ('status', 'serial', 'get_timer')
+
+POLL_MSG = {"cmd": "status", "poll": True}  # Queued by the poller, changes go to radout/<mac>/status
+MAX_BURST = 8  # Queued messages for one thermostat run over a connection before it is released
+KEEPALIVE = 300  # s, MQTT keepalive, a PINGREQ is sent after half of it, a dead link fails the ping
+NTP_RETRY = 60  # s until NTP is tried again after a failure
+
+# Gateway counters for the metrics topic
+counters = {"rx": 0, "tx": 0, "errors": 0, "connect_failures": 0, "coalesced": 0, "journaled": 0}
+heap_min = None  # Lowest free heap seen (B)
+published = {}  # MAC -> last status dict published (delta publishing)
+inflight = {}  # MAC -> messages taken from the queue by workers and not answered yet
+boot_ms = {"start": _boot}  # Boot phase -> ms since reset, published on radout/boot
+client = None  # MQTT client, None while the broker is not connected
+link = None  # MQTTLink, reconnects the client
+journal = None  # Journal, keeps messages and queued commands over outages and resets
+shadow = None  # Shadow, desired state of the thermostats
+clock_synced = False  # Set by NTP
+_ntp_next = None  # ticks_ms of the next NTP attempt after a failure
+
+
+def boot_phase(name):
+    boot_ms[name] = time.ticks_ms()
+    print(f'Boot: {name} after {boot_ms[name]} ms')
+
+
+def wifi_begin():
+    # Start associating, the BLE stack comes up in the meantime
+    import network
     sta_if = network.WLAN(network.WLAN.IF_STA)
     if not sta_if.isconnected():
-        print('\nConnecting to WiFi')
+        print('Connecting to WiFi')
         sta_if.active(True)
         sta_if.connect(config.SSID, config.PASSWD)
-        while not sta_if.isconnected():
-            print(".", end='')
-            time.sleep(0.5)
-            pass
-    print('connected!\nNetwork config:', sta_if.ipconfig('addr4'))
+    return sta_if
+
+
+async def wifi_wait(sta_if):
+    # Wait for the connection, start over if the access point does not answer within WIFI_TIMEOUT
+    start = time.ticks_ms()
+    while not sta_if.isconnected():
+        if time.ticks_diff(time.ticks_ms(), start) >= config.WIFI_TIMEOUT * 1000:
+            print('WiFi timeout, connecting again')
+            sta_if.disconnect()
+            sta_if.connect(config.SSID, config.PASSWD)
+            start = time.ticks_ms()
+        await asyncio.sleep_ms(50)
+    print('Network config:', sta_if.ipconfig('addr4'))
+
 
-    # Set time via NTP
-    ntptime.settime()
-    print('Current time:', time.localtime(), '\n')
+def ensure_time():
+    # Only the status command (it sets the thermostat clock) and vacation mode need the date, so NTP
+    # runs before the first of them instead of delaying the boot. Blocks for up to a second once.
+    global clock_synced, _ntp_next
+    if clock_synced:
+        return
+    if _ntp_next is None or time.ticks_diff(time.ticks_ms(), _ntp_next) >= 0:
+        import ntptime
+        try:
+            ntptime.settime()
+            clock_synced = True
+            boot_phase('ntp')
+            publish('boot', boot_ms, retain=True)
+            print('Current time:', time.localtime())
+            return
+        except OSError as e:
+            _ntp_next = time.ticks_add(time.ticks_ms(), NTP_RETRY * 1000)
+            print('NTP failed:', e)
+    # The RTC keeps the time over a soft reset, it is only unusable after a power loss
+    if time.localtime()[0] < 2025:
+        raise Exception("Clock not set, NTP failed")
 
 
-def mqtt_connect():
+def tls_context():
+    # Built once: the CA certificate is read from flash here, not on every reconnect. MicroPython's ssl
+    # cannot resume TLS sessions, every reconnect does a full handshake.
+    import ssl
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-    context.verify_mode = ssl.CERT_NONE
+    if config.MQTT_CA:
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_verify_locations(cafile=config.MQTT_CA)
+    else:
+        print('Warning: the broker certificate is not verified, set MQTT_CA')
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def tls_clock():
+    # Certificates are only valid for a period, the clock must be set before they can be checked
+    if config.MQTT_TLS and config.MQTT_CA and time.localtime()[0] < 2025:
+        ensure_time()
+
+
+def mqtt_client():
+    from umqtt.simple import MQTTClient
     client = MQTTClient(client_id=config.MQTT_CLIENT_ID,
                         server=config.MQTT_SERVER,
                         port=config.MQTT_PORT,
                         user=config.MQTT_USER,
                         password=config.MQTT_PASSWD,
-                        keepalive=7200,
-                        ssl=context
+                        keepalive=KEEPALIVE,
+                        ssl=tls_context() if config.MQTT_TLS else None
                         )
-    client.connect()
     client.set_callback(sub)
-    client.connect()
-    print('Connected to MQTT Broker.')
+    return client
+
 
-    # Sub to topics
+def mqtt_subscribe(client):
+    # After every (re)connect, the broker forgets the subscriptions of a clean session
     client.subscribe(f'{config.DEVICE_NAME}/radin/scan'.encode())
     client.subscribe(f'{config.DEVICE_NAME}/radin/trv'.encode())
     print('Subscribed to topics.')
-    return client
+
+
+def broker_lost(e):
+    # Socket error while talking to the broker, main() connects again
+    global client
+    client = None
+    if link is not None:
+        link.lost(e)
+
+
+def publish(topic, res, retain=False):
+    # res is JSON encoded unless it is bytes already. Without broker the message goes to the journal
+    # (dropped if it is off), retained topics and metrics only keep their newest message.
+    counters["tx"] += 1
+    if isinstance(res, dict) and 'error' in res:
+        counters["errors"] += 1
+    payload = res if isinstance(res, bytes) else json.dumps(res).encode()
+    if client is not None:
+        try:
+            client.publish(f'{config.DEVICE_NAME}/radout/{topic}'.encode(), payload, retain, qos=0)
+            return
+        except OSError as e:
+            broker_lost(e)
+    if journal is not None:
+        counters["journaled"] += 1
+        journal.publish(topic, payload, retain, retain or topic == 'metrics')
+
+
+def replay():
+    # After a reconnect: publish the journaled messages in order, before anything new
+    if journal is None:
+        return
+    sent = 0
+    try:
+        for topic, payload, retain in journal.messages():
+            client.publish(f'{config.DEVICE_NAME}/radout/{topic}'.encode(), payload, retain, qos=0)
+            sent += 1
+    except OSError as e:
+        broker_lost(e)
+    journal.sent(sent)
+    if sent:
+        print(f'Journal: {sent} messages published')
+
+
+def publish_status(mac, status):
+    # Changed status of a thermostat: retained on radout/<mac>/status (complete, JSON or binary),
+    # optionally the changed fields only on radout/<mac>/delta
+    doc = status.to_dict()
+    if config.STATUS_FORMAT == 'bin':
+        publish(f'{mac}/status', status.pack(), retain=True)
+    else:
+        publish(f'{mac}/status', doc, retain=True)
+
+    if config.STATUS_DELTA:
+        last = published.get(mac, {})
+        delta = {}
+        for key, value in doc.items():
+            if last.get(key) != value:
+                delta[key] = value
+        for key in last:
+            if key not in doc:
+                delta[key] = None  # E.g. vacation ended
+        if delta:
+            publish(f'{mac}/delta', delta)
+        published[mac] = doc
 
 
 def sub(topic, msg):
+    # Only parse and queue here, the BLE work is done by the workers
     print('Received message %s on topic %s' % (msg, topic))
+    counters["rx"] += 1
     topic_str = topic.decode()
-    msg_j = json.loads(msg.decode())
+    try:
+        msg_j = json.loads(msg.decode())
+    except ValueError:
+        publish('status', {"error": "invalid_json"})
+        return
+    if not isinstance(msg_j, dict):
+        publish('status', {"error": "unknown_parameter"})
+        return
 
-    # Handle msgs
     if topic_str == f'{config.DEVICE_NAME}/radin/scan':
-        res = eq.scan()
-
-        # Publish results
-        client.publish(f'{config.DEVICE_NAME}/radout/devlist'.encode(),
-                       json.dumps({"devices": res}).encode(),
-                       qos=0
-                       )
+        # The background scan answers right away, {"active": true} forces a new scan
+        if config.BACKGROUND_SCAN and not msg_j.get('active'):
+            publish('devlist', {"devices": mgr.registry.macs(), "seen": mgr.registry.to_dict()})
+        else:
+            enqueue(PRIO_BULK, None, msg_j)
 
     elif topic_str == f'{config.DEVICE_NAME}/radin/trv':
-        try:
-            eq.connect(msg_j['mac'], max_retries=3)
-        except Exception as e:
-            client.publish(f'{config.DEVICE_NAME}/radout/status'.encode(),
-                       json.dumps({"error": "timeout"}).encode(),
-                       qos=0
-                       )
+        # A list of MACs runs the command on all thermostats in parallel
+        # {"mac": ["00:1A:22:XX:XX:XX", "00:1A:22:YY:YY:YY"], "cmd": "temp", "params": "eco"}
+        macs = msg_j.get('mac')
+        if not isinstance(msg_j.get('cmd'), str) and not isinstance(msg_j.get('cmds'), list):
+            publish('status', {"error": "unknown_command"})
+        elif isinstance(macs, list) and macs and all(valid_mac(mac) for mac in macs):
+            for mac in macs:
+                enqueue(PRIO_BULK, mac, msg_j)
+        elif valid_mac(macs):
+            enqueue(priority(msg_j), macs, msg_j)
+        else:
+            publish('status', {"error": "unknown_parameter"})
+
+    else:
+        print(f'Unknown topic: {topic_str}')
+
+
+def valid_mac(mac):
+    # "XX:XX:XX:XX:XX:XX" (hex), every accepted MAC gets a device object that is kept
+    if not isinstance(mac, str) or len(mac) != 17:
+        return False
+    for i in range(17):
+        if i % 3 == 2:
+            if mac[i] != ':':
+                return False
+        elif mac[i] not in '0123456789abcdefABCDEF':
+            return False
+    return True
+
+
+def priority(msg_j):
+    if 'cmds' in msg_j:
+        return PRIO_GET
+    cmd = msg_j.get('cmd', '').lower()
+    if cmd in SET_CMDS:
+        return PRIO_SET
+    if cmd in ('week', 'reset'):
+        return PRIO_BULK
+    return PRIO_GET
+
+
+def enqueue(prio, mac, msg_j, seq=None):
+    # seq: journal record of a command replayed after a reset
+    if mac is not None:
+        mac = mac.upper()
+    if mac is not None:
+        # Set commands the thermostat already matches are answered with its status, without sending.
+        # Not while an older command for it (batches and polls too) is queued or running, it could still
+        # change the state.
+        if shadow is not None and 'cmds' not in msg_j:
+            status = state.get(mac, 'status', config.SHADOW_STATUS_AGE)
+            if status is not None and not shadow.needed(msg_j, status) and not mgr.lock(mac).locked() \
+                    and mac not in inflight and not queue.has(mac):
+                shadow.skipped += 1
+                shadow.want(mac, msg_j)  # Replaces a pending value of the same setting
+                shadow.observe(mac, status)
+                publish('status', status.to_dict())
+                journal_done(seq)
+                return
+
+        # Reads with "max_age" are answered right away if the cache is fresh enough
+        res = cached_result(mac, msg_j)
+        if res is not None:
+            publish('status', res)
+            journal_done(seq)
+            return
+
+        # Never ahead of an older message for the same thermostat: a setpoint must not overtake a
+        # batch queued before it. Polls only read and don't count.
+        prio = max(prio, queue.level(mac, PRIO_BULK))
+
+        if coalesce(prio, mac, msg_j):
+            shadow_want(mac, msg_j)
+            journal_done(seq)
             return
 
-        # Get serial number, firmware version, pin
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "serial"}
-        if msg_j['cmd'].lower() == 'serial':
-            res = {"info": eq.get_serial()}
-
-        # Get status
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "status"}
-        elif msg_j['cmd'].lower() == 'status':
-            res = eq.get_status()
-
-        # Set mode
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "mode", "params": "auto"}
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "mode", "params": {"temp": 20.0, "time": [19, 1, 2025, 20, 30]}}
-        elif msg_j['cmd'].lower() == 'mode':
-            if not isinstance(msg_j['params'], dict) and msg_j['params'].lower() == 'manual':
-                res = eq.set_mode(eqiva.MODE_MANUAL)
-            elif not isinstance(msg_j['params'], dict) and msg_j['params'].lower() == 'auto':
-                res = eq.set_mode(eqiva.MODE_AUTO)
-            elif isinstance(msg_j['params'], dict) and len(msg_j['params']['time']) == 5:
-                t = msg_j['params']['time']
-                res = eq.set_mode(0, msg_j['params']['temp'], t[0], t[1], t[2], (t[3], t[4]))
+    # [MAC, message, number of answers to publish, journal seq]
+    item = [mac, msg_j, 1, seq]
+    if not queue.put(prio, item):
+        print('Queue full, dropping message')
+        journal_done(seq)
+        if mac is None:
+            publish('devlist', {"error": "busy"})
+        else:
+            publish('status', {"error": "busy", "mac": mac})
+    elif mac is not None:
+        shadow_want(mac, msg_j)
+        if journal is not None and seq is None:
+            # Journaled until it is answered, a reset in between runs it again
+            item[3] = journal.command(prio, mac, msg_j)
+
+
+def shadow_want(mac, msg_j):
+    # Only accepted commands become desired state, a rejected one (busy) must not be sent later
+    if shadow is not None and 'cmds' not in msg_j:
+        shadow.want(mac, msg_j)
+
+
+def journal_done(seq):
+    if journal is not None and seq is not None:
+        journal.done(seq)
+
+
+def coalesce_key(msg_j):
+    # Kind of setting a message changes, only a message of the same kind supersedes it.
+    # Boost and the comfort / eco presets are not setpoints, vacation is not a mode switch.
+    cmd = msg_j.get('cmd', '').lower()
+    params = msg_j.get('params')
+    if cmd == 'temp' and isinstance(params, str):
+        return 'temp/boost' if params.lower() in ('boost_on', 'boost_off') else 'temp/preset'
+    if cmd == 'mode' and isinstance(params, dict):
+        return 'mode/vacation'
+    return cmd
+
+
+def coalesce(prio, mac, msg_j):
+    # Merge into the last queued message of the thermostat if it is of the same kind:
+    # a newer setpoint supersedes the queued one, an equal read shares its result.
+    # Every message still gets its answer.
+    if 'cmds' in msg_j:
+        return False
+    item = queue.last(prio, mac)
+    if item is None or 'cmds' in item[1]:
+        return False
+    cmd = msg_j.get('cmd', '').lower()
+    if coalesce_key(msg_j) != coalesce_key(item[1]):
+        return False
+
+    if cmd in COALESCE_CMDS:
+        item[1] = msg_j
+        if journal is not None and item[3] is not None:
+            journal.command(prio, mac, msg_j, item[3])
+    elif cmd not in SHARED_CMDS or msg_j.get('params') != item[1].get('params'):
+        return False
+    item[2] += 1
+    counters["coalesced"] += 1
+    return True
+
+
+async def worker():
+    # Run queued messages, several workers keep the pooled connections busy
+    while True:
+        mac, msg_j, replies, seq = await queue.get()
+        if mac is not None:
+            inflight[mac] = inflight.get(mac, 0) + 1
+        try:
+            if mac is None:
+                await handle_scan()
             else:
-                res = {"error": "unknown_mode"}
+                await handle_device(mac, msg_j, replies, seq)
+        except Exception as e:
+            publish('status', {"error": str(e), "mac": mac})
+            journal_done(seq)
+        finally:
+            if mac is not None:
+                inflight[mac] -= 1
+                if not inflight[mac]:
+                    del inflight[mac]
+
+
+async def handle_scan():
+    res = await mgr.scan()
+
+    # Publish results
+    publish('devlist', {"devices": res, "seen": mgr.registry.to_dict()})
+
 
-        # Set temperature
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "temp", "params": 22.4}
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "temp", "params": "boost_on"}
-        elif msg_j['cmd'].lower() == 'temp':
-            if isinstance(msg_j['params'], float):
-                res = eq.set_temp(msg_j['params'])
-            elif isinstance(msg_j['params'], str):
-                if msg_j['params'].lower() == 'comfort':
-                    res = eq.set_temp(0, eqiva.COMFORT)
-                elif msg_j['params'].lower() == 'eco':
-                    res = eq.set_temp(0, eqiva.ECO)
-                elif msg_j['params'].lower() == 'boost_on':
-                    res = eq.set_temp(0, eqiva.BOOST_ON)
-                elif msg_j['params'].lower() == 'boost_off':
-                    res = eq.set_temp(0, eqiva.BOOST_OFF)
+def cached_result(mac, msg_j):
+    # Answer reads with "max_age" (s) from memory, without touching BLE
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "status", "max_age": 60}
+    if msg_j.get('max_age') is None or 'cmd' not in msg_j:
+        return None
+    cmd = msg_j['cmd'].lower()
+    if cmd == 'status':
+        status = state.get(mac, 'status', msg_j['max_age'])
+        return status.to_dict() if status is not None else None
+    if cmd == 'serial':
+        info = state.get(mac, 'info', msg_j['max_age'])
+        return {"info": info} if info is not None else None
+    if cmd == 'get_timer' and isinstance(msg_j.get('params'), str):
+        timer = state.get(mac, 'timer/' + msg_j['params'].upper(), msg_j['max_age'])
+        return {"timer": timer} if timer is not None else None
+    return None
+
+
+async def handle_device(mac, msg_j, replies=1, seq=None):
+    async with mgr.lock(mac):
+        try:
+            eq = await pool.acquire(mac, max_retries=3)
+        except Exception as e:
+            counters["connect_failures"] += 1
+            if msg_j.get('poll'):
+                poller.done(mac, None, False)
+            for _ in range(replies):
+                publish('status', {"error": "timeout", "mac": mac, "reason": str(e)})
+            journal_done(seq)
+            return
+
+        burst = 0
+        while msg_j is not None:
+            try:
+                if 'cmds' in msg_j:
+                    res = await run_batch(eq, msg_j['cmds'])
                 else:
-                    res = {"error": "unknown_mode"}
-            else:
-                res = {"error": "unknown_parameter"}
+                    res = await run_cmd(eq, msg_j)
+            except Exception as e:
+                res = {"error": str(e)}
 
-        # Get timer
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "get_timer", "params": "fri"}
-        elif msg_j['cmd'].lower() == 'get_timer':
-            if isinstance(msg_j['params'], str):
-                res = {"timer": eq.get_timer(msg_j['params'])}
-            else:
-                res = {"error": "unknown_parameter"}
+            # Every status change is published on the thermostat's own topic, settings it confirms are
+            # no longer pending
+            changed = poller.observe(mac, eq.status) if eq.status.length else False
+            if shadow is not None and eq.status.length:
+                shadow.observe(mac, eq.status)
+            if changed:
+                publish_status(mac, eq.status)
+            if msg_j.get('poll'):
+                poller.done(mac, eq.status if 'error' not in res else None, changed)
 
-        # Set timer
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "set_timer", "params": {"day": "fri", "temps_times": [...]}}
-        elif msg_j['cmd'].lower() == 'set_timer':
-            if isinstance(msg_j['params']['temps_times'], list):
-                res = {"day": eq.set_timer(msg_j['params']['day'], msg_j['params']['temps_times'])}
-            else:
-                res = {"error": "unknown_parameter"}
+            # Publish results, once per coalesced message
+            for _ in range(replies):
+                publish('status', res)
+            journal_done(seq)
 
-        # Set comfort / eco temperature
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "comfort_eco", "params": {"comfort": 22.5, "eco": 10.0}}
-        elif msg_j['cmd'].lower() == 'comfort_eco':
-            if isinstance(msg_j['params']['comfort'], float) and isinstance(msg_j['params']['eco'], float):
-                res = eq.conf_comfort_eco(msg_j['params']['comfort'], msg_j['params']['eco'])
-            else:
-                res = {"error": "unknown_parameter"}
+            # Further queued messages for this thermostat use the open connection. Not while another
+            # worker waits for the lock with an older message, the newer ones must run after it.
+            burst += 1
+            item = queue.take(mac) if burst < MAX_BURST and inflight.get(mac) == 1 else None
+            msg_j, replies, seq = (item[1], item[2], item[3]) if item is not None else (None, 0, None)
 
-        # Set window open temperature
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "window_open", "params": {"temp": 12.5, "duration": 30}}
-        elif msg_j['cmd'].lower() == 'window_open':
-            if isinstance(msg_j['params']['temp'], float) and isinstance(msg_j['params']['duration'], int):
-                res = eq.conf_window_open(msg_j['params']['temp'], msg_j['params']['duration'])
-            else:
-                res = {"error": "unknown_parameter"}
 
-        # Set offset temperature
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "offset", "params": 3.5}
-        elif msg_j['cmd'].lower() == 'offset':
-            if isinstance(msg_j['params'], float):
-                res = eq.conf_offset(msg_j['params'])
-            else:
-                res = {"error": "unknown_parameter"}
+async def pool_task():
+    # Close connections that were not used for a while
+    while True:
+        await asyncio.sleep(5)
+        try:
+            await pool.evict_idle()
+        except Exception as e:
+            # Try again in the next round, idle links must not stay open for good
+            print(f'Pool: closing idle links failed: {e}')
+
+
+async def poll_task():
+    # Read the status of all known thermostats in staggered slots
+    while True:
+        await asyncio.sleep(1)
+        for mac in config.POLL_MACS:
+            poller.add(mac)
+        for mac, dev in mgr.devices.items():
+            # Only thermostats that exist: connected once or seen by a scan
+            if dev.metrics.connects or mgr.registry.age(mac) is not None:
+                poller.add(mac)
+
+        for mac in poller.due():
+            # Keep half of the queue free for user commands
+            if len(queue) >= queue.max_size // 2 or not queue.put(PRIO_POLL, [mac, POLL_MSG, 0, None]):
+                poller.done(mac, None, False)
+
+
+async def reconcile_task():
+    # Send settings that did not reach their thermostat again, only those it does not match yet.
+    # Runs behind user commands over one connection, the status changes go to radout/<mac>/status.
+    while True:
+        await asyncio.sleep(5)
+        for mac in shadow.due():
+            if len(queue) >= queue.max_size // 2 or mgr.lock(mac).locked() or mgr.get(mac).metrics.holdoff_ms():
+                continue
+            cmds = shadow.commands(mac, state.get(mac, 'status'))
+            if cmds and queue.put(PRIO_BULK, [mac, {"cmds": cmds, "reconcile": True}, 0, None]):
+                shadow.reconciled += len(cmds)
+
+
+async def journal_task():
+    # Journal records are written in batches, a reset loses at most JOURNAL_FLUSH seconds of them
+    while True:
+        await asyncio.sleep(config.JOURNAL_FLUSH)
+        journal.flush()
+
+
+def heap_free():
+    global heap_min
+    try:
+        free = gc.mem_free()
+    except AttributeError:  # CPython (simulator / benchmarks)
+        return None
+    if heap_min is None or free < heap_min:
+        heap_min = free
+    return free
+
+
+async def metrics_task():
+    # Publish gateway and per thermostat statistics, histograms are
+    # [count, avg ms, max ms, <=50, <=100, <=200, <=500, <=1000, <=2000, <=5000, <=10000, more]
+    # {"heap": [free, min free], "msgs": {...}, "pool": {...}, "queue": {...},
+    #  "dev": {"00:1A:22:XX:XX:XX": {"con": [connects, failures, attempts], "con_ms": [...],
+    #                                "req": [requests, timeouts], "rep_ms": [...], "rssi": -70}}}
+    while True:
+        heap_free()
+        await asyncio.sleep(config.METRICS_INTERVAL)
+        publish('metrics', {"heap": [heap_free(), heap_min], "msgs": counters, "pool": pool.stats(),
+                            "queue": queue.stats(), "mqtt": link.stats() if link else None,
+                            "journal": journal.stats() if journal else None,
+                            "shadow": shadow.stats() if shadow else None,
+                            "dev": mgr.metrics()})
+
+
+async def run_batch(eq, cmds):
+    # Run several commands over one connection and collect one result document
+    # {"mac": "00:1A:22:XX:XX:XX", "cmds": [{"cmd": "comfort_eco", "params": {...}}, {"cmd": "offset", "params": -1.0}]}
+    # Commands answered with a status get "ok", only the last status is returned
+    results = []
+    status = None
+    for c in cmds:
+        # A broken entry only fails its own slot, the commands before it already ran
+        cmd = c.get('cmd') if isinstance(c, dict) else None
+        if not isinstance(cmd, str):
+            results.append({"error": "unknown_command"})
+            continue
+        try:
+            res = await run_cmd(eq, c)
+        except Exception as e:
+            res = {"error": str(e)}
 
-        # Set offset temperature
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "lock", "params": true}
-        elif msg_j['cmd'].lower() == 'lock':
-            if isinstance(msg_j['params'], bool):
-                res = eq.set_lock(msg_j['params'])
+        if cmd.lower() in STATUS_CMDS and not (isinstance(res, dict) and 'error' in res):
+            status = res
+            res = "ok"
+        results.append(res)
+
+    return {"results": results, "status": status}
+
+
+async def run_cmd(eq, msg_j):
+    # Get serial number, firmware version, pin
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "serial"}
+    if msg_j['cmd'].lower() == 'serial':
+        res = {"info": await eq.get_serial()}
+
+    # Get status
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "status"}
+    elif msg_j['cmd'].lower() == 'status':
+        ensure_time()
+        res = await eq.get_status()
+
+    # Set mode
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "mode", "params": "auto"}
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "mode", "params": {"temp": 20.0, "time": [19, 1, 2025, 20, 30]}}
+    elif msg_j['cmd'].lower() == 'mode':
+        if not isinstance(msg_j['params'], dict) and msg_j['params'].lower() == 'manual':
+            res = await eq.set_mode(eqiva.MODE_MANUAL)
+        elif not isinstance(msg_j['params'], dict) and msg_j['params'].lower() == 'auto':
+            res = await eq.set_mode(eqiva.MODE_AUTO)
+        elif isinstance(msg_j['params'], dict) and len(msg_j['params']['time']) == 5:
+            t = msg_j['params']['time']
+            ensure_time()
+            res = await eq.set_mode(0, msg_j['params']['temp'], t[0], t[1], t[2], (t[3], t[4]))
+        else:
+            res = {"error": "unknown_mode"}
+
+    # Set temperature
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "temp", "params": 22.4}
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "temp", "params": "boost_on"}
+    elif msg_j['cmd'].lower() == 'temp':
+        if isinstance(msg_j['params'], float):
+            res = await eq.set_temp(msg_j['params'])
+        elif isinstance(msg_j['params'], str):
+            if msg_j['params'].lower() == 'comfort':
+                res = await eq.set_temp(0, eqiva.COMFORT)
+            elif msg_j['params'].lower() == 'eco':
+                res = await eq.set_temp(0, eqiva.ECO)
+            elif msg_j['params'].lower() == 'boost_on':
+                res = await eq.set_temp(0, eqiva.BOOST_ON)
+            elif msg_j['params'].lower() == 'boost_off':
+                res = await eq.set_temp(0, eqiva.BOOST_OFF)
             else:
-                res = {"error": "unknown_parameter"}
+                res = {"error": "unknown_mode"}
+        else:
+            res = {"error": "unknown_parameter"}
+
+    # Get timer
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "get_timer", "params": "fri"}
+    elif msg_j['cmd'].lower() == 'get_timer':
+        if isinstance(msg_j['params'], str):
+            res = {"timer": await eq.get_timer(msg_j['params'])}
+        else:
+            res = {"error": "unknown_parameter"}
+
+    # Set timer
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "set_timer", "params": {"day": "fri", "temps_times": [...]}}
+    elif msg_j['cmd'].lower() == 'set_timer':
+        if isinstance(msg_j['params']['temps_times'], list):
+            res = {"day": await eq.set_timer(msg_j['params']['day'], msg_j['params']['temps_times'])}
+        else:
+            res = {"error": "unknown_parameter"}
+
+    # Get / set the timers of the whole week, only changed days are written
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "week"}
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "week", "params": {"mon": [...], "tue": [...]}}
+    elif msg_j['cmd'].lower() == 'week':
+        if msg_j.get('params') is None:
+            res = {"week": await eq.get_week()}
+        elif isinstance(msg_j['params'], dict):
+            res = {"written": await eq.set_week(msg_j['params'])}
+        else:
+            res = {"error": "unknown_parameter"}
+
+    # Set comfort / eco temperature
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "comfort_eco", "params": {"comfort": 22.5, "eco": 10.0}}
+    elif msg_j['cmd'].lower() == 'comfort_eco':
+        if isinstance(msg_j['params']['comfort'], float) and isinstance(msg_j['params']['eco'], float):
+            res = await eq.conf_comfort_eco(msg_j['params']['comfort'], msg_j['params']['eco'])
+        else:
+            res = {"error": "unknown_parameter"}
 
-        # Factory reset
-        # {"mac": "00:1A:22:XX:XX:XX", "cmd": "reset"}
-        elif msg_j['cmd'].lower() == 'reset':
-            res = {"info": eq.factory_reset()}
+    # Set window open temperature
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "window_open", "params": {"temp": 12.5, "duration": 30}}
+    elif msg_j['cmd'].lower() == 'window_open':
+        if isinstance(msg_j['params']['temp'], float) and isinstance(msg_j['params']['duration'], int):
+            res = await eq.conf_window_open(msg_j['params']['temp'], msg_j['params']['duration'])
+        else:
+            res = {"error": "unknown_parameter"}
+
+    # Set offset temperature
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "offset", "params": 3.5}
+    elif msg_j['cmd'].lower() == 'offset':
+        if isinstance(msg_j['params'], float):
+            res = await eq.conf_offset(msg_j['params'])
+        else:
+            res = {"error": "unknown_parameter"}
 
-        # Final
+    # Set offset temperature
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "lock", "params": true}
+    elif msg_j['cmd'].lower() == 'lock':
+        if isinstance(msg_j['params'], bool):
+            res = await eq.set_lock(msg_j['params'])
         else:
-            print('Unknown command')
-            res = {"error": "unknown_command"}
-
-        # Publish results
-        client.publish(f'{config.DEVICE_NAME}/radout/status'.encode(),
-                       json.dumps(res).encode(),
-                       qos=0
-                       )
-        eq.disconnect()
+            res = {"error": "unknown_parameter"}
+
+    # Factory reset
+    # {"mac": "00:1A:22:XX:XX:XX", "cmd": "reset"}
+    elif msg_j['cmd'].lower() == 'reset':
+        res = {"info": await eq.factory_reset()}
+
+    # Final
     else:
-        print(f'Unknown topic: {topic_str}')
+        print('Unknown command')
+        res = {"error": "unknown_command"}
 
+    return res
+
+
+def setup(transport=None):
+    # Thermostat side of the gateway, transport replaces the BLE stack (e.g. simulator.SimBLE)
+    global mgr, pool, state, queue, poller, journal, shadow
+    mgr = aeqiva.EqivaManager(max_connections=config.MAX_CONNECTIONS, transport=transport,
+                              write_response=config.WRITE_RESPONSE)
+    pool = ConnectionPool(mgr, config.POOL_SIZE, config.POOL_IDLE_TIMEOUT)
+    state = StateCache(config.STATE_TTL_STATUS, config.STATE_TTL_INFO, config.STATE_TTL_TIMER)
+    queue = CommandQueue(config.QUEUE_SIZE)
+    poller = Poller(config.POLL_INTERVAL or 300, config.POLL_FAST_INTERVAL, config.POLL_MAX_INTERVAL)
+    mgr.on_update = state.put  # Every decoded notification refreshes the cache (a reset clears it)
+    mgr.week_ttl = config.STATE_TTL_TIMER  # A week write re-sends days cached longer
+    if config.BACKGROUND_SCAN:
+        mgr.seen_max_age = config.SEEN_MAX_AGE
+        mgr.start_background_scan(config.SCAN_INTERVAL_US, config.SCAN_WINDOW_US)
+    if config.SHADOW:
+        shadow = Shadow(config.SHADOW_RETRY, config.SHADOW_RETRY_MAX, config.SHADOW_EXPIRE)
+        asyncio.create_task(reconcile_task())
+    if config.JOURNAL_MAX:
+        # Commands that were queued when the gateway was reset run again
+        journal = Journal(config.JOURNAL_PATH, config.JOURNAL_MAX)
+        for seq, prio, mac, msg_j in journal.load():
+            enqueue(prio, mac, msg_j, seq)
+        asyncio.create_task(journal_task())
+    for _ in range(pool.max_size):
+        asyncio.create_task(worker())
+    asyncio.create_task(pool_task())
+    if config.POLL_INTERVAL:
+        asyncio.create_task(poll_task())
+    if config.METRICS_INTERVAL:
+        asyncio.create_task(metrics_task())
 
-if __name__ == '__main__':
-    # Initial setup
-    wifi_connect()
-    client = mqtt_connect()
-    eq = eqiva.Eqiva()
 
-    # Receive msgs
+async def main():
+    global client, link
+    # Staged start: BLE comes up while WiFi associates, NTP waits until a command needs the clock
+    sta_if = wifi_begin()
+    setup()
+    boot_phase('ble')
+    await wifi_wait(sta_if)
+    boot_phase('wifi')
+    link = MQTTLink(mqtt_client(), mqtt_subscribe, tls_clock, config.MQTT_BACKOFF_MIN, config.MQTT_BACKOFF_MAX)
+    await link.connect()
+    client = link.client
+    boot_phase('mqtt')
+    replay()
+    publish('boot', boot_ms, retain=True)
+
+    # Receive msgs, BLE work runs in the workers
     print('Waiting for incoming messages...')
+    last_ping = time.ticks_ms()
     while True:
-        client.wait_msg()
+        if client is None:
+            # The workers keep running, their results are journaled until the broker is back
+            await wifi_wait(sta_if)
+            await link.connect()
+            client = link.client
+            last_ping = time.ticks_ms()
+            replay()
+
+        try:
+            # Read everything that arrived, check_msg() handles one message per call
+            rx = -1
+            while client is not None and rx != counters["rx"]:
+                rx = counters["rx"]
+                client.check_msg()
+
+            if client is not None and time.ticks_diff(time.ticks_ms(), last_ping) >= KEEPALIVE * 500:
+                client.ping()
+                last_ping = time.ticks_ms()
+        except OSError as e:
+            broker_lost(e)
+        except Exception as e:
+            # A message that could not be handled must not stop the gateway
+            print(f'Error handling message: {e}')
+            counters["errors"] += 1
+        heap_free()
+        await asyncio.sleep_ms(50)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+# Offline journal for the Eqiva MQTT gateway (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import json
+import os
+import struct
+
+# Record kinds
+PUBLISH = 1  # Outbound message the broker did not get
+COMMAND = 2  # Inbound command accepted into the queue, flags hold its priority
+DONE = 3  # Command answered
+
+# Flags of PUBLISH records
+RETAIN = 0x01
+REPLACE = 0x02  # Only the newest message of the topic is kept
+
+RECORD = 64  # Bytes per record, a message takes as many records as it needs
+_HEADER = '<BBHBH'  # kind, flags, seq, topic length, data length
+_HEADER_SIZE = 7
+
+
+def _records(topic_len, data_len):
+    return (_HEADER_SIZE + topic_len + data_len + RECORD - 1) // RECORD
+
+
+def _encode(entry):
+    kind, flags, seq, topic, data = entry[0], entry[1], entry[2], entry[3], entry[4]
+    buf = bytearray(_records(len(topic), len(data)) * RECORD)
+    struct.pack_into(_HEADER, buf, 0, kind, flags, seq, len(topic), len(data))
+    buf[_HEADER_SIZE:_HEADER_SIZE + len(topic)] = topic
+    buf[_HEADER_SIZE + len(topic):_HEADER_SIZE + len(topic) + len(data)] = data
+    return buf
+
+
+def _size(entry):
+    return _records(len(entry[3]), entry[6]) * RECORD
+
+
+def _live(entries, written=None):
+    """Entries that still matter, in order: open commands (newest record of each) and messages
+    (newest of a REPLACE topic). For a batch, written holds the seqs of commands in the file, their
+    DONE records are kept."""
+    done = set()
+    commands = {}  # seq -> index of the newest COMMAND
+    topics = {}  # REPLACE topic -> index of the newest PUBLISH
+    for i, entry in enumerate(entries):
+        if entry[0] == DONE:
+            done.add(entry[2])
+        elif entry[0] == COMMAND:
+            commands[entry[2]] = i
+        elif entry[1] & REPLACE:
+            topics[entry[3]] = i
+
+    res = []
+    for i, entry in enumerate(entries):
+        kind = entry[0]
+        if kind == DONE:
+            if written is not None and entry[2] in written:
+                res.append(entry)
+        elif kind == COMMAND:
+            if entry[2] not in done and commands[entry[2]] == i:
+                res.append(entry)
+        elif not entry[1] & REPLACE or topics[entry[3]] == i:
+            res.append(entry)
+    return res
+
+
+class Journal:
+    """Append-only file of fixed size records on flash, keeps what the broker and the queue would lose.
+
+    Records are collected in RAM and written in batches by flush(). Records that cancel each other (a
+    command and its DONE, older messages of a REPLACE topic) never reach the flash if they meet in the
+    same batch. Beyond max_size the file is compacted and the oldest messages are dropped.
+    Entries: [kind, flags, seq, topic, data, file offset, data length], data is None until read.
+    """
+
+    def __init__(self, path='journal.bin', max_size=32768, batch=4096):
+        self.path = path
+        self.max_size = max_size
+        self.batch = batch
+        self._buf = []  # Entries not written yet
+        self._buf_size = 0
+        self._size = 0  # Valid bytes in the file
+        self._written = set()  # Seqs of the open commands in the file
+        self.seq = 0
+        self.writes = 0  # Flash writes (appends and rewrites)
+        self.dropped = 0  # Entries dropped because of max_size
+
+    def _index(self):
+        """Entries of the file, stops at the first broken record (power loss while writing)."""
+        entries = []
+        pos = 0
+        try:
+            file_size = os.stat(self.path)[6]
+            f = open(self.path, 'rb')
+        except OSError:
+            self._size = 0
+            return entries
+        with f:
+            while pos + _HEADER_SIZE <= file_size:
+                kind, flags, seq, topic_len, data_len = struct.unpack(_HEADER, f.read(_HEADER_SIZE))
+                size = _records(topic_len, data_len) * RECORD
+                if not PUBLISH <= kind <= DONE or pos + size > file_size:
+                    break
+                entries.append([kind, flags, seq, f.read(topic_len), None, pos, data_len])
+                pos += size
+                f.seek(pos)
+        self._size = pos
+        return entries
+
+    def _read(self, f, entry):
+        if entry[4] is None:
+            f.seek(entry[5] + _HEADER_SIZE + len(entry[3]))
+            return f.read(entry[6])
+        return entry[4]
+
+    def _append(self, kind, flags, seq, topic, data):
+        entry = [kind, flags, seq, topic, data, None, len(data)]
+        self._buf.append(entry)
+        self._buf_size += _size(entry)
+        if self._buf_size >= self.batch:
+            self.flush()
+
+    def _trim(self, entries, limit):
+        """Drop the oldest messages, then the oldest commands, until entries fit into limit (B)."""
+        total = 0
+        for entry in entries:
+            total += _size(entry)
+        for kind in (PUBLISH, COMMAND):
+            i = 0
+            while total > limit and i < len(entries):
+                if entries[i][0] == kind:
+                    total -= _size(entries.pop(i))
+                    self.dropped += 1
+                else:
+                    i += 1
+        return entries
+
+    def _rewrite(self, entries, limit=None):
+        """Replace the file (or the buffer, if nothing was written yet) by entries."""
+        entries = self._trim(entries, limit or self.max_size)
+        self._buf = []
+        self._buf_size = 0
+        if not self._size and not [entry for entry in entries if entry[4] is None]:
+            # Everything is still in RAM, keep it there
+            for entry in entries:
+                self._buf.append(entry)
+                self._buf_size += _size(entry)
+            return
+
+        tmp = self.path + '.tmp'
+        size = 0
+        with open(tmp, 'wb') as out:
+            try:
+                src = open(self.path, 'rb')
+            except OSError:
+                src = None
+            self._written = set()
+            for entry in entries:
+                data = self._read(src, entry) if src else entry[4]
+                out.write(_encode([entry[0], entry[1], entry[2], entry[3], data]))
+                size += _size(entry)
+                if entry[0] == COMMAND:
+                    self._written.add(entry[2])
+            if src:
+                src.close()
+        if size:
+            os.rename(tmp, self.path)
+        else:
+            os.remove(tmp)
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self._size = size
+        self.writes += 1
+
+    def load(self):
+        """Read the file after a reset, returns the open commands [(seq, priority, MAC, message)]."""
+        entries = self._index()
+        try:
+            file_size = os.stat(self.path)[6]
+        except OSError:
+            file_size = 0
+        if file_size != self._size:
+            print(f'Journal: {file_size - self._size} B broken, compacting')
+            self._rewrite(_live(entries))
+            entries = self._index()
+        entries = _live(entries)
+
+        commands = []
+        f = open(self.path, 'rb') if self._size else None
+        for entry in entries:
+            if entry[0] == COMMAND:
+                self._written.add(entry[2])
+                data = self._read(f, entry) if f else entry[4]
+                commands.append((entry[2], entry[1], entry[3].decode(), json.loads(data)))
+            self.seq = max(self.seq, entry[2] + 1) & 0xffff
+        if f:
+            f.close()
+        return commands
+
+    def publish(self, topic, payload, retain=False, replace=False):
+        """Keep a message the broker did not get."""
+        self._append(PUBLISH, (RETAIN if retain else 0) | (REPLACE if replace else 0), 0, topic.encode(), payload)
+
+    def command(self, prio, mac, msg_j, seq=None):
+        """Keep an accepted command until done(), a seq of an earlier record replaces its message."""
+        if seq is None:
+            seq = self.seq
+            self.seq = (self.seq + 1) & 0xffff
+        self._append(COMMAND, prio, seq, mac.encode(), json.dumps(msg_j).encode())
+        return seq
+
+    def done(self, seq):
+        self._append(DONE, 0, seq, b'', b'')
+
+    def flush(self):
+        """Write the buffered records, compact the file if it grows beyond max_size."""
+        entries = _live(self._buf, self._written)
+        size = 0
+        for entry in entries:
+            size += _size(entry)
+        if not entries:
+            self._buf = []
+            self._buf_size = 0
+        elif self._size + size > self.max_size:
+            # Leave a quarter free, so the following batches are appended again
+            self._rewrite(_live(self._index() + self._buf), self.max_size * 3 // 4)
+        else:
+            with open(self.path, 'ab') as f:
+                for entry in entries:
+                    f.write(_encode(entry))
+                    if entry[0] == COMMAND:
+                        self._written.add(entry[2])
+                    elif entry[0] == DONE:
+                        self._written.discard(entry[2])
+            self._size += size
+            self.writes += 1
+            self._buf = []
+            self._buf_size = 0
+
+    def messages(self):
+        """Kept messages in order: (topic, payload, retain). Confirm the published ones with sent()."""
+        entries = _live(self._index() + self._buf) if self._size else _live(self._buf)
+        f = open(self.path, 'rb') if self._size else None
+        try:
+            for entry in entries:
+                if entry[0] == PUBLISH:
+                    yield entry[3].decode(), self._read(f, entry) if f else entry[4], entry[1] & RETAIN
+        finally:
+            if f:
+                f.close()
+
+    def sent(self, n):
+        """Forget the first n messages of messages(), they reached the broker."""
+        if not n:
+            return
+        entries = _live(self._index() + self._buf) if self._size else _live(self._buf)
+        res = []
+        for entry in entries:
+            if entry[0] == PUBLISH and n:
+                n -= 1
+            else:
+                res.append(entry)
+        self._rewrite(res)
+
+    def stats(self):
+        return {"size": self._size, "buffered": len(self._buf), "writes": self.writes, "dropped": self.dropped}
@@ -0,0 +1,7 @@
+# Starts the Eqiva MQTT gateway when it is installed as .mpy or frozen into the firmware
+# v0.2 (c) Copyright prefixFelix 2025
+
+import asyncio
+import gateway
+
+asyncio.run(gateway.main())
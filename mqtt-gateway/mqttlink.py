@@ -0,0 +1,68 @@
+# Managed MQTT broker connection for the Eqiva MQTT gateway (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import asyncio
+import random
+import time
+
+
+class MQTTLink:
+    """Keeps a umqtt client connected. connect() retries with growing, randomized delays.
+
+    before_connect is called before every attempt (e.g. to set the clock for the certificate check),
+    on_connect after every successful one (subscriptions).
+    """
+
+    def __init__(self, client, on_connect, before_connect=None, backoff_min=1, backoff_max=300):
+        self.client = client
+        self.on_connect = on_connect
+        self.before_connect = before_connect
+        self.backoff_min_ms = int(backoff_min * 1000)
+        self.backoff_max_ms = int(backoff_max * 1000)
+        self.up = False
+        self.connects = 0
+        self.failures = 0  # Failed connection attempts
+        self.drops = 0  # Established connections that were lost
+        self.since = 0  # ticks_ms of the last connect / loss
+
+    async def connect(self):
+        """Connect and subscribe, retry until it works."""
+        delay = self.backoff_min_ms
+        while not self.up:
+            try:
+                if self.before_connect:
+                    self.before_connect()
+                self.client.connect()
+                self.on_connect(self.client)
+                self.up = True
+            except Exception as e:  # OSError, MQTTException (refused)
+                self.failures += 1
+                self._close()
+                wait = delay // 2 + random.getrandbits(16) % (delay // 2 + 1)
+                print(f'Broker connection failed ({e}), next attempt in {wait} ms')
+                await asyncio.sleep_ms(wait)
+                delay = min(delay * 2, self.backoff_max_ms)
+        self.connects += 1
+        self.since = time.ticks_ms()
+        print('Connected to MQTT Broker.')
+
+    def lost(self, e):
+        """The socket failed (OSError from publish / check_msg / ping), connect() again."""
+        if not self.up:
+            return
+        print(f'Broker connection lost: {e}')
+        self.up = False
+        self.drops += 1
+        self.since = time.ticks_ms()
+        self._close()
+
+    def _close(self):
+        sock = getattr(self.client, 'sock', None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"up": self.up, "connects": self.connects, "failures": self.failures, "drops": self.drops}
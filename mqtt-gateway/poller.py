@@ -0,0 +1,75 @@
+# Fleet status poller for the Eqiva MQTT gateway (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import time
+
+# Mode flags that make a thermostat change on its own soon (see eqiva.MODE_FLAGS)
+_ACTIVE_FLAGS = 0x04 | 0x10  # Boost, open window
+
+
+class Poller:
+    """Decides when the status of each thermostat is read.
+
+    Devices get evenly spaced slots over the interval, so the BLE load stays flat. While boost or
+    open window is active a device is read every fast_interval, each read without changes stretches
+    its interval by half, up to max_interval (s).
+    """
+
+    def __init__(self, interval=300, fast_interval=60, max_interval=1800):
+        self.interval_ms = int(interval * 1000)
+        self.fast_ms = int(fast_interval * 1000)
+        self.max_ms = int(max_interval * 1000)
+        self._due = {}  # MAC -> ticks_ms of the next read
+        self._interval = {}  # MAC -> current interval (ms)
+        self._last = {}  # MAC -> last seen status bytes
+
+    def __len__(self):
+        return len(self._due)
+
+    def add(self, mac):
+        """Poll a thermostat, the slots of all devices are spread over the interval again."""
+        mac = mac.upper()
+        if mac in self._due:
+            return
+        self._due[mac] = 0
+        self._interval[mac] = self.interval_ms
+        now = time.ticks_ms()
+        step = self.interval_ms // len(self._due)
+        for i, mac in enumerate(sorted(self._due)):
+            self._due[mac] = time.ticks_add(now, (i + 1) * step)
+
+    def remove(self, mac):
+        mac = mac.upper()
+        self._due.pop(mac, None)
+        self._interval.pop(mac, None)
+        self._last.pop(mac, None)
+
+    def due(self):
+        """MACs whose read is due. They are not returned again until done() or the interval passed."""
+        now = time.ticks_ms()
+        res = [mac for mac, due in self._due.items() if time.ticks_diff(now, due) >= 0]
+        for mac in res:
+            self._due[mac] = time.ticks_add(now, self._interval[mac])
+        return res
+
+    def observe(self, mac, status):
+        """Compare a decoded status with the last one of the device, True if it changed."""
+        raw = bytes(status.raw())
+        changed = self._last.get(mac) != raw
+        self._last[mac] = raw
+        return changed
+
+    def done(self, mac, status, changed):
+        """Schedule the next read after a poll (status None if it failed)."""
+        if mac not in self._due:
+            return
+        if status is None or changed:
+            self._interval[mac] = self.interval_ms
+        else:
+            self._interval[mac] = min(self._interval[mac] * 3 // 2, self.max_ms)
+
+        if status is not None and status.mode & _ACTIVE_FLAGS:
+            wait = self.fast_ms
+        else:
+            wait = self._interval[mac]
+        self._due[mac] = time.ticks_add(time.ticks_ms(), wait)
@@ -0,0 +1,98 @@
+# Connection pool for the Eqiva MQTT gateway (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import asyncio
+import time
+
+
+class ConnectionPool:
+    """Keeps recently used thermostat connections open. Least recently used / idle links get closed."""
+
+    def __init__(self, mgr, max_size=3, idle_timeout=30):
+        self.mgr = mgr
+        self.max_size = min(max_size, mgr.max_connections)
+        self.idle_timeout_ms = int(idle_timeout * 1000)
+        self._lru = []  # Pooled MACs, least recently used first
+        self._last_used = {}  # MAC -> ticks_ms
+        self._connecting = 0  # Slots reserved by connects in progress
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _touch(self, mac):
+        if mac in self._lru:
+            self._lru.remove(mac)
+        self._lru.append(mac)
+        self._last_used[mac] = time.ticks_ms()
+
+    def _drop(self, mac):
+        if mac in self._lru:
+            self._lru.remove(mac)
+        self._last_used.pop(mac, None)
+
+    def _prune(self):
+        """Forget links that were closed by the thermostat."""
+        for mac in [mac for mac in self._lru if not self.mgr.get(mac).is_connected]:
+            self._drop(mac)
+
+    async def _evict(self, mac):
+        self._drop(mac)
+        self.evictions += 1
+        print(f"Pool: closing {mac}")
+        # Held until the link is down, a worker would otherwise still see it connected and write to it
+        async with self.mgr.lock(mac):
+            await self.mgr.disconnect(mac)
+
+    async def _make_room(self, keep):
+        """Close the least recently used link that is not in use."""
+        while True:
+            self._prune()
+            if len(self._lru) + self._connecting < self.max_size:
+                return
+            for mac in self._lru:
+                if mac != keep and not self.mgr.lock(mac).locked():
+                    await self._evict(mac)
+                    break
+            else:
+                # All pooled links are busy, wait for one to become free
+                await asyncio.sleep_ms(100)
+
+    async def acquire(self, mac, max_retries=3):
+        """Return a connected device, reusing an open link if possible.
+
+        The caller must hold mgr.lock(mac) while using the device.
+        """
+        mac = mac.upper()
+        dev = self.mgr.get(mac)
+        if dev.is_connected:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._drop(mac)
+            await self._make_room(mac)
+            self._connecting += 1
+            try:
+                await self.mgr.connect(mac, max_retries)
+            finally:
+                self._connecting -= 1
+        self._touch(mac)
+        return dev
+
+    async def evict_idle(self):
+        """Close all links that were not used for idle_timeout."""
+        self._prune()
+        for mac in list(self._lru):
+            # Workers may have dropped or used a link while the previous one was closed
+            last_used = self._last_used.get(mac)
+            if last_used is not None and time.ticks_diff(time.ticks_ms(), last_used) >= self.idle_timeout_ms \
+                    and not self.mgr.lock(mac).locked():
+                await self._evict(mac)
+
+    async def close(self):
+        """Close all pooled links."""
+        for mac in list(self._lru):
+            await self._evict(mac)
+
+    def stats(self):
+        """Counters to tune max_size and idle_timeout."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "open": len(self._lru)}
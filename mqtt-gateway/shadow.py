@@ -0,0 +1,204 @@
+# Desired thermostat state for the Eqiva MQTT gateway (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import time
+from eq3codec import Encoder
+
+# Status mode flags (see eqiva.MODE_FLAGS)
+_MANUAL = 0x01
+_LOCKED = 0x20
+
+_enc = Encoder()  # Only checks that desired values can be sent
+
+
+def _temp(value):
+    """Temperature as the thermostat stores it (0.5 °C steps, rounded down)."""
+    return int(float(value) * 2) / 2
+
+
+def _fields(msg_j):
+    """Desired fields of a set command, None if the command is not tracked.
+
+    Boost is not tracked, it ends by itself after 5 minutes.
+    """
+    cmd = msg_j.get('cmd', '').lower()
+    params = msg_j.get('params')
+    if cmd == 'temp':
+        if isinstance(params, float):
+            return {'temp': _temp(params)}
+    elif cmd == 'mode':
+        if isinstance(params, str) and params.lower() in ('manual', 'auto'):
+            return {'manual': params.lower() == 'manual'}
+    elif cmd == 'comfort_eco':
+        if isinstance(params, dict) and isinstance(params.get('comfort'), float) \
+                and isinstance(params.get('eco'), float):
+            return {'comfort': _temp(params['comfort']), 'eco': _temp(params['eco'])}
+    elif cmd == 'window_open':
+        if isinstance(params, dict) and isinstance(params.get('temp'), float) \
+                and isinstance(params.get('duration'), int):
+            return {'window_temp': _temp(params['temp']), 'window_time': params['duration']}
+    elif cmd == 'offset':
+        if isinstance(params, float):
+            return {'offset': params}
+    elif cmd == 'lock':
+        if isinstance(params, bool):
+            return {'lock': params}
+    return None
+
+
+def _valid(msg_j):
+    """False if the params of a tracked command are out of range, the thermostat would never take them."""
+    cmd = msg_j.get('cmd', '').lower()
+    params = msg_j['params']
+    try:
+        if cmd == 'temp':
+            _enc.temp(params)
+        elif cmd == 'comfort_eco':
+            _enc.comfort_eco(params['comfort'], params['eco'])
+        elif cmd == 'window_open':
+            _enc.window_open(params['temp'], params['duration'])
+        elif cmd == 'offset':
+            _enc.offset(params)
+    except ValueError:
+        return False
+    return True
+
+
+def _commands(fields, status):
+    """Commands that bring a thermostat with status (None: unknown) to fields, in sending order."""
+    res = []
+    mode = status.mode if status is not None else None
+    extended = status is not None and status.extended
+
+    # The mode first, switching to auto changes the target temperature
+    if 'manual' in fields and (mode is None or bool(mode & _MANUAL) != fields['manual']):
+        res.append({"cmd": "mode", "params": "manual" if fields['manual'] else "auto"})
+    if 'temp' in fields and (status is None or status.temperature != fields['temp']):
+        res.append({"cmd": "temp", "params": fields['temp']})
+    if 'comfort' in fields and (not extended or status.comfort_temp != fields['comfort']
+                                or status.eco_temp != fields['eco']):
+        res.append({"cmd": "comfort_eco", "params": {"comfort": fields['comfort'], "eco": fields['eco']}})
+    if 'window_temp' in fields and (not extended or status.window_open_temp != fields['window_temp']
+                                    or status.window_open_time != fields['window_time']):
+        res.append({"cmd": "window_open", "params": {"temp": fields['window_temp'],
+                                                      "duration": fields['window_time']}})
+    if 'offset' in fields and (not extended or status.temp_offset != fields['offset']):
+        res.append({"cmd": "offset", "params": fields['offset']})
+    if 'lock' in fields and (mode is None or bool(mode & _LOCKED) != fields['lock']):
+        res.append({"cmd": "lock", "params": fields['lock']})
+    return res
+
+
+class Shadow:
+    """Desired state per thermostat, kept until a status confirms it.
+
+    Set commands are only sent if the thermostat differs from them. Settings that did not arrive
+    (thermostat out of range, connect failed) are sent again in the background, every retry (s),
+    doubling up to max_retry, until expire. Confirmed settings are forgotten, so changes made at the
+    thermostat itself are never reverted.
+    """
+
+    def __init__(self, retry=30, max_retry=600, expire=3600):
+        self.retry_ms = int(retry * 1000)
+        self.max_retry_ms = int(max_retry * 1000)
+        self.expire_ms = int(expire * 1000)
+        self._desired = {}  # MAC -> {field: value}
+        self._since = {}  # MAC -> ticks_ms of the last change of the desired state
+        self._due = {}  # MAC -> ticks_ms of the next reconciliation
+        self._retry = {}  # MAC -> current retry interval (ms)
+        self.skipped = 0  # Commands not sent, the thermostat already matched
+        self.reconciled = 0  # Commands sent again by the reconciler
+        self.expired = 0  # Settings given up
+
+    def __len__(self):
+        return len(self._desired)
+
+    def want(self, mac, msg_j):
+        """Record the desired state of an accepted set command, True if the command is tracked."""
+        cmd = msg_j.get('cmd', '').lower()
+        params = msg_j.get('params')
+        desired = self._desired.get(mac)
+        if cmd == 'reset':
+            self.forget(mac)
+            return False
+        fields = _fields(msg_j)
+        if fields is None:
+            preset = cmd == 'temp' and isinstance(params, str) and params.lower() in ('comfort', 'eco')
+            vacation = cmd == 'mode' and isinstance(params, dict)
+            if desired is not None and (preset or vacation):
+                # Comfort / eco / vacation set the target temperature (and mode) by themselves
+                desired.pop('temp', None)
+                if vacation:
+                    desired.pop('manual', None)
+                if not desired:
+                    self.forget(mac)
+            return False
+        if not _valid(msg_j):
+            return False
+
+        if desired is None:
+            desired = self._desired[mac] = {}
+        desired.update(fields)
+        self._retry[mac] = self.retry_ms
+        now = time.ticks_ms()
+        self._since[mac] = now
+        self._due[mac] = time.ticks_add(now, self._retry[mac])  # The command itself goes first
+        return True
+
+    def needed(self, msg_j, status):
+        """False if the thermostat with status already is in the state the set command asks for.
+
+        Values the thermostat cannot take never match, the command is sent and gets its error. In auto
+        mode the thermostat changes its target temperature at the switch points of its schedule, an
+        older status does not prove that a temperature is still set.
+        """
+        fields = _fields(msg_j)
+        if fields is None or status is None or not _valid(msg_j):
+            return True
+        if 'temp' in fields and not status.mode & _MANUAL:
+            return True
+        return bool(_commands(fields, status))
+
+    def commands(self, mac, status):
+        """Commands that are still needed for the desired state of mac."""
+        desired = self._desired.get(mac)
+        return _commands(desired, status) if desired else []
+
+    def observe(self, mac, status):
+        """Forget the desired fields a new status confirms."""
+        desired = self._desired.get(mac)
+        if desired is None:
+            return
+        needed = {}
+        for cmd in _commands(desired, status):
+            needed.update(_fields(cmd))
+        for key in list(desired):
+            if key not in needed:
+                del desired[key]
+        if not desired:
+            self.forget(mac)
+
+    def forget(self, mac):
+        self._desired.pop(mac, None)
+        self._since.pop(mac, None)
+        self._due.pop(mac, None)
+        self._retry.pop(mac, None)
+
+    def due(self):
+        """MACs whose desired state should be sent again, the next attempt waits twice as long."""
+        now = time.ticks_ms()
+        res = []
+        for mac in list(self._desired):
+            if time.ticks_diff(now, self._since[mac]) >= self.expire_ms:
+                print(f'Shadow: giving up {mac} {self._desired[mac]}')
+                self.expired += 1
+                self.forget(mac)
+            elif time.ticks_diff(now, self._due[mac]) >= 0:
+                self._retry[mac] = min(self._retry[mac] * 2, self.max_retry_ms)
+                self._due[mac] = time.ticks_add(now, self._retry[mac])
+                res.append(mac)
+        return res
+
+    def stats(self):
+        return {"pending": len(self._desired), "skipped": self.skipped, "reconciled": self.reconciled,
+                "expired": self.expired}
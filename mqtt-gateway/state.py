@@ -0,0 +1,45 @@
+# Thermostat state cache for the Eqiva MQTT gateway (MicroPython)
+# v0.2 (c) Copyright prefixFelix 2025
+
+import time
+
+
+class StateCache:
+    """Last known state per thermostat. Status, info (serial / firmware / pin) and timers expire separately."""
+
+    def __init__(self, ttl_status=300, ttl_info=86400, ttl_timer=3600):
+        self.ttl_ms = {
+            'status': int(ttl_status * 1000),
+            'info': int(ttl_info * 1000),
+            'timer': int(ttl_timer * 1000),
+        }
+        self._entries = {}  # MAC -> {kind: (ticks_ms, value)}
+
+    def put(self, mac, kind, value):
+        """Store decoded data, kind is 'status', 'info' or 'timer/<DAY>'. 'reset' forgets the device."""
+        if kind == 'reset':
+            self.invalidate(mac)
+            return
+        self._entries.setdefault(mac.upper(), {})[kind] = (time.ticks_ms(), value)
+
+    def get(self, mac, kind, max_age=None):
+        """Return the value if it is younger than its TTL and max_age (s), else None."""
+        entries = self._entries.get(mac.upper())
+        if not entries or kind not in entries:
+            return None
+
+        ticks, value = entries[kind]
+        age = time.ticks_diff(time.ticks_ms(), ticks)
+        if age >= self.ttl_ms[kind.split('/')[0]]:
+            del entries[kind]
+            return None
+        if max_age is not None and age > max_age * 1000:
+            return None
+        return value
+
+    def invalidate(self, mac, kind=None):
+        """Forget one kind or everything known about a thermostat."""
+        if kind is None:
+            self._entries.pop(mac.upper(), None)
+        elif mac.upper() in self._entries:
+            self._entries[mac.upper()].pop(kind, None)
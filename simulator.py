@@ -0,0 +1,324 @@
+# Eqiva (EQ3) radiator thermostat simulator (CPython)
+# v0.2 (c) Copyright prefixFelix 2025
+#
+# SimBLE is a BLE transport for eqiva.Eqiva / aeqiva.EqivaManager that talks to simulated
+# thermostats instead of the radio. Latency, packet loss and the number of devices are
+# configurable, random decisions use a seeded generator so runs can be reproduced.
+#
+#   import simulator, eqiva
+#   eq = eqiva.Eqiva(transport=simulator.SimBLE.fleet(3, latency_ms=40, loss=0.05, seed=1))
+#
+# Importing this module on CPython adds the MicroPython functions the modules use
+# (time.sleep_ms / ticks_*, asyncio.sleep_ms / wait_for_ms / ThreadSafeFlag, micropython.schedule).
+
+import asyncio
+import random
+import threading
+import time
+
+# BLE IRQ event constants
+_IRQ_SCAN_RESULT = 5
+_IRQ_SCAN_DONE = 6
+_IRQ_PERIPHERAL_CONNECT = 7
+_IRQ_PERIPHERAL_DISCONNECT = 8
+_IRQ_GATTC_WRITE_DONE = 17
+_IRQ_GATTC_NOTIFY = 18
+
+HANDLE_NOTIFY = 0x0421
+
+# Advertising data of a thermostat: flags, complete local name "CC-RT-BLE"
+ADV_DATA = b'\x02\x01\x06\x0a\x09CC-RT-BLE'
+
+
+# MicroPython compatibility (CPython only)
+
+def const(x):
+    return x
+
+
+_scheduled = []
+
+
+def schedule(func, arg):
+    """micropython.schedule: run func(arg) later on the main thread."""
+    _scheduled.append((func, arg))
+
+
+def run_scheduled():
+    """Run the callbacks queued by schedule() (MicroPython does this between bytecodes)."""
+    while _scheduled:
+        func, arg = _scheduled.pop(0)
+        func(arg)
+
+
+def _sleep_ms(ms):
+    run_scheduled()
+    time.sleep(ms / 1000)
+    run_scheduled()
+
+
+def _ticks_ms():
+    return time.monotonic_ns() // 1000000
+
+
+def _ticks_us():
+    return time.monotonic_ns() // 1000
+
+
+class ThreadSafeFlag:
+    """asyncio.ThreadSafeFlag, set() must be called from the event loop thread."""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+if not hasattr(time, 'sleep_ms'):
+    time.sleep_ms = _sleep_ms
+    time.ticks_ms = _ticks_ms
+    time.ticks_us = _ticks_us
+    time.ticks_add = lambda ticks, delta: ticks + delta
+    time.ticks_diff = lambda a, b: a - b
+    asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    asyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+
+
+class SimThermostat:
+    """One thermostat, answers commands like the real device (see the EQ3 protocol description)."""
+
+    def __init__(self, mac, serial="OEQ0123456", firmware=146, rssi=-70):
+        self.mac = mac.upper()
+        self.addr = bytes.fromhex(mac.replace(':', ''))
+        self.serial = serial
+        self.firmware = firmware
+        self.rssi = rssi
+        self.in_range = True  # False: neither advertises nor accepts connections (e.g. empty battery)
+        self.reset()
+
+    def reset(self):
+        """Factory defaults."""
+        self.mode = 0x08  # Auto, DST
+        self.valve = 0
+        self.target = 42  # 21.0°
+        self.vacation = bytearray(4)  # Day, year, 30 min counter, month
+        self.window_open_temp = 24  # 12.0°
+        self.window_open_time = 3  # 15 min
+        self.comfort = 42  # 21.0°
+        self.eco = 34  # 17.0°
+        self.offset = 7  # 0.0°
+        # Per day: base temperature, 24:00
+        self.timers = [bytearray([34, 144] + [0] * 12) for _ in range(7)]
+
+    def status(self):
+        return bytes([0x02, 0x01, self.mode, self.valve, 0x04, self.target]) + bytes(self.vacation) + bytes([
+            self.window_open_temp, self.window_open_time, self.comfort, self.eco, self.offset])
+
+    def handle(self, cmd):
+        """Apply a command, return the notification (or None)."""
+        op = cmd[0]
+        if op == 0x00:
+            return bytes([0x01, self.firmware, 0x00, 0x00]) + bytes(ord(c) + 0x30 for c in self.serial) + b'\x00'
+        if op == 0x03:
+            pass  # Sets the clock
+        elif op == 0x40 and len(cmd) >= 6:
+            self.mode = (self.mode & ~0x03) | 0x02
+            self.target = cmd[1] - 128
+            self.vacation = bytearray([cmd[2], cmd[3], cmd[4], cmd[5]])
+        elif op == 0x40:
+            self.mode = (self.mode & ~0x03) | (0x01 if cmd[1] == 0x40 else 0x00)
+        elif op == 0x41:
+            self.target = cmd[1]
+        elif op == 0x43:
+            self.target = self.comfort
+        elif op == 0x44:
+            self.target = self.eco
+        elif op == 0x45:
+            self.mode = self.mode | 0x04 if cmd[1] else self.mode & ~0x04
+        elif op == 0x11:
+            self.comfort, self.eco = cmd[1], cmd[2]
+        elif op == 0x14:
+            self.window_open_temp, self.window_open_time = cmd[1], cmd[2]
+        elif op == 0x13:
+            self.offset = cmd[1]
+        elif op == 0x80:
+            self.mode = self.mode | 0x20 if cmd[1] else self.mode & ~0x20
+        elif op == 0x20:
+            return bytes([0x21, cmd[1]]) + bytes(self.timers[cmd[1]])
+        elif op == 0x10:
+            self.timers[cmd[1]] = bytearray(cmd[2:16])
+            return bytes([0x02, 0x02, cmd[1]])
+        elif op == 0xF0:
+            self.reset()
+            return bytes([0x02, 0x00, 0x00])
+        else:
+            return None
+        return self.status()
+
+
+class SimBLE:
+    """Simulated bluetooth.BLE with EQ3 thermostats as peripherals.
+
+    latency_ms: one ATT round trip (write with response costs two), jitter_ms: random extra delay,
+    loss: probability that a notification is lost, connect_ms / connect_loss: connection setup.
+    """
+
+    def __init__(self, devices=(), latency_ms=30, jitter_ms=10, loss=0.0, connect_ms=300,
+                 connect_loss=0.0, max_connections=4, seed=None):
+        self.devices = {dev.addr: dev for dev in devices}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.connect_ms = connect_ms
+        self.connect_loss = connect_loss
+        self.max_connections = max_connections
+        self.random = random.Random(seed)
+        self._active = False
+        self._irq = None
+        self._conns = {}  # conn_handle -> SimThermostat
+        self._next_handle = 1
+        self._pending = None  # (conn_handle, timer) of the pending connection
+        self._scan_timers = []
+        self._scan_id = 0  # Changes with every gap_scan() call, stops the advertisements of older scans
+        # Counters
+        self.writes = 0
+        self.notifications = 0
+        self.lost = 0
+
+    @classmethod
+    def fleet(cls, n, **kwargs):
+        """Transport with n thermostats, MACs 00:1A:22:00:00:01 ..."""
+        devices = [SimThermostat("00:1A:22:00:00:{:02X}".format(i + 1), serial="OEQ{:07d}".format(i + 1),
+                                 rssi=-50 - i * 5) for i in range(n)]
+        return cls(devices, **kwargs)
+
+    def _delay(self, base_ms):
+        return (base_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+
+    def _fire(self, event, data):
+        if event == _IRQ_PERIPHERAL_CONNECT:
+            self._pending = None
+        if self._irq:
+            self._irq(event, data)
+
+    def _call_async(self, func, args):
+        func(*args)
+        run_scheduled()
+
+    def _later(self, delay, func, args):
+        """Call func(*args) after delay seconds on the event loop if one runs, else on a timer thread."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            timer = threading.Timer(delay, func, args)
+            timer.daemon = True
+            timer.start()
+            return timer
+        return loop.call_later(delay, self._call_async, func, args)
+
+    def _deliver(self, delay, event, data):
+        """Raise an IRQ after delay seconds."""
+        return self._later(delay, self._fire, (event, data))
+
+    def _advertise(self, scan_id, dev, interval):
+        # Continuous scan: one advertisement per scan interval and device, the RSSI varies
+        if scan_id != self._scan_id:
+            return
+        if not dev.in_range:
+            self._later(interval, self._advertise, (scan_id, dev, interval))
+            return
+        rssi = dev.rssi + self.random.randint(-4, 4)
+        self._fire(_IRQ_SCAN_RESULT, (0, dev.addr, 0, rssi, ADV_DATA))
+        self._later(interval, self._advertise, (scan_id, dev, interval))
+
+    # bluetooth.BLE interface
+
+    def active(self, state=None):
+        if state is not None:
+            self._active = bool(state)
+        return self._active
+
+    def irq(self, handler):
+        self._irq = handler
+
+    def gap_connect(self, addr_type, addr=None, scan_duration_ms=2000, *args):
+        if addr_type is None:
+            # Cancel the pending connection
+            if self._pending is not None:
+                handle, timer = self._pending
+                timer.cancel()
+                self._conns.pop(handle, None)
+                self._pending = None
+            return
+
+        if len(self._conns) >= self.max_connections:
+            raise OSError(12)  # ENOMEM, like NimBLE
+        dev = self.devices.get(bytes(addr))
+        if dev is None or not dev.in_range or self.random.random() < self.connect_loss:
+            return  # Not in range, the caller times out
+
+        handle = self._next_handle
+        self._next_handle += 1
+        self._conns[handle] = dev
+        self._pending = (handle, self._deliver(self._delay(self.connect_ms), _IRQ_PERIPHERAL_CONNECT,
+                                               (handle, 0, dev.addr)))
+
+    def gap_disconnect(self, conn_handle):
+        dev = self._conns.pop(conn_handle, None)
+        if dev is None:
+            return False
+        self._deliver(self._delay(self.latency_ms), _IRQ_PERIPHERAL_DISCONNECT, (conn_handle, 0, dev.addr))
+        return True
+
+    def gap_scan(self, duration_ms, interval_us=1280000, window_us=11250, active=False):
+        for timer in self._scan_timers:
+            timer.cancel()
+        self._scan_timers = []
+        self._scan_id += 1
+        if duration_ms is None:
+            self._deliver(0, _IRQ_SCAN_DONE, ())
+            return
+
+        if duration_ms == 0:
+            # Scan until stopped
+            for dev in self.devices.values():
+                at = self.random.uniform(0, interval_us / 1000000)
+                self._later(at, self._advertise, (self._scan_id, dev, interval_us / 1000000))
+            return
+
+        for dev in self.devices.values():
+            if not dev.in_range:
+                continue
+            at = self.random.uniform(0, min(duration_ms, 1000)) / 1000
+            self._scan_timers.append(self._deliver(at, _IRQ_SCAN_RESULT, (0, dev.addr, 0, dev.rssi, ADV_DATA)))
+        self._scan_timers.append(self._deliver(duration_ms / 1000, _IRQ_SCAN_DONE, ()))
+
+    def gattc_write(self, conn_handle, value_handle, data, mode=0):
+        dev = self._conns.get(conn_handle)
+        if dev is None:
+            raise OSError(128)  # ENOTCONN
+        self.writes += 1
+
+        # A write with response costs a round trip before the thermostat processes it
+        delay = self._delay(self.latency_ms)
+        if mode == 1:
+            self._deliver(delay, _IRQ_GATTC_WRITE_DONE, (conn_handle, value_handle, 0))
+            delay += self._delay(self.latency_ms)
+
+        reply = dev.handle(bytes(data))
+        if reply is None:
+            return
+        if self.random.random() < self.loss:
+            self.lost += 1
+            return
+        self.notifications += 1
+        self._deliver(delay, _IRQ_GATTC_NOTIFY, (conn_handle, HANDLE_NOTIFY, reply))
@@ -0,0 +1,144 @@
+# Round trip checks of the EQ3 protocol encoding (eq3codec) against the decoders (eqiva.Status, decode_timer)
+# v0.2 (c) Copyright prefixFelix 2025
+#
+# On a PC:      PYTHONPATH=. python3 tests/test_eq3codec.py  (or python3 -m pytest tests)
+# On the ESP32: mpremote connect /dev/ttyUSB0 cp eq3codec.py eqiva.py :/lib/ + run tests/test_eq3codec.py
+
+import eq3codec
+import eqiva
+
+enc = eq3codec.Encoder()
+
+# Status notification: manual + DST, valve 0%, 21.0°, vacation bytes, window open / comfort / eco / offset
+STATUS = b'\x02\x01\x09\x00\x04\x2a' + bytes(9)
+
+
+class Rand:
+    """Small LCG, the same schedules on CPython and MicroPython."""
+
+    def __init__(self, seed):
+        self.state = seed
+
+    def below(self, n):
+        self.state = (self.state * 1103515245 + 12345) & 0x7fffffff
+        return (self.state >> 8) % n
+
+
+def apply(raw, cmd):
+    """Put the values of a command where the thermostat reports them in its status notification."""
+    op = cmd[0]
+    if op == 0x41:
+        raw[5] = cmd[1]
+    elif op == 0x40 and len(cmd) == 6:  # Vacation: temperature + 128, day, year, 30 min steps, month
+        raw[2] |= 0x02
+        raw[5] = cmd[1] - 128
+        raw[6:10] = cmd[2:6]
+    elif op == 0x11:
+        raw[12], raw[13] = cmd[1], cmd[2]
+    elif op == 0x14:
+        raw[10], raw[11] = cmd[1], cmd[2]
+    elif op == 0x13:
+        raw[14] = cmd[1]
+
+
+def decode(cmd):
+    """Status record after the thermostat took cmd."""
+    raw = bytearray(STATUS)
+    apply(raw, cmd)
+    status = eqiva.Status()
+    assert status.decode(raw)
+    return status
+
+
+def raises(func, *args):
+    try:
+        func(*args)
+    except ValueError:
+        return True
+    return False
+
+
+def test_temp():
+    for code in range(9, 61):
+        assert decode(enc.temp(code / 2)).temperature == code / 2, code
+    assert decode(enc.temp(21.3)).temperature == 21.0  # Rounded down to 0.5 °C
+    assert raises(enc.temp, 4.0) and raises(enc.temp, 30.5)
+
+
+def test_offset():
+    for step in range(-7, 8):
+        assert decode(enc.offset(step / 2)).temp_offset == step / 2, step
+    assert raises(enc.offset, 1.3) and raises(enc.offset, 4.0)
+
+
+def test_comfort_eco():
+    for code in range(10, 61):
+        status = decode(enc.comfort_eco(code / 2, (70 - code) / 2))
+        assert (status.comfort_temp, status.eco_temp) == (code / 2, (70 - code) / 2), code
+    assert raises(enc.comfort_eco, 4.5, 17.0)
+
+
+def test_window_open():
+    for code in range(10, 61):
+        for duration in range(0, 155, 5):
+            status = decode(enc.window_open(code / 2, duration))
+            assert (status.window_open_temp, status.window_open_time) == (code / 2, duration), (code, duration)
+    assert raises(enc.window_open, 12.0, 7) and raises(enc.window_open, 12.0, 155)
+
+
+def test_vacation():
+    for code in range(9, 61):
+        for hour, minute in ((0, 0), (6, 30), (13, 0), (23, 30)):
+            status = decode(enc.vacation(code / 2, 24, 12, 2025, hour, minute))
+            assert status.temperature == code / 2
+            assert status.to_dict()["vacation"] == {"day": 24, "month": 12, "year": 2025, "time": [hour, minute]}
+
+
+def schedule(rand, periods, code):
+    """Random day with periods temperature periods, sorted switch times from 00:10 to 24:00.
+
+    A switch at 00:00 to 0.0 °C would read as the end of the list, the thermostat has none.
+    """
+    times = []
+    while len(times) < periods - 1:
+        step = 1 + rand.below(eq3codec.TIME_END)
+        if step not in times:
+            times.append(step)
+    times.sort()
+    temps_times = [(code / 2, None, None)]
+    for step in times:
+        temps_times.append((rand.below(61) / 2, step // 6, step % 6 * 10))
+    return temps_times
+
+
+def check_timer(day, temps_times):
+    cmd = enc.set_timer(day, temps_times)
+    events = eq3codec.decode_timer(b'\x21' + cmd[1:])
+    # A day with room left ends with the 24:00 marker
+    if len(events) > len(temps_times):
+        assert events.pop() == (0.0, "24:00"), events
+    assert events[0] == (temps_times[0][0], None)
+    assert len(events) == len(temps_times), (temps_times, events)
+    for (temp, hour, minute), (value, at) in zip(temps_times[1:], events[1:]):
+        assert (value, at) == (temp, f"{hour:02d}:{minute:02d}"), (temps_times, events)
+
+
+def test_timer():
+    rand = Rand(1)
+    for code in range(61):  # Every temperature code as base temperature, 1 - 7 periods
+        for periods in range(1, 8):
+            check_timer(eq3codec.DAYS[code % 7], schedule(rand, periods, code))
+
+    # Switch times at the limits of the day
+    check_timer("mon", [(17.0, None, None), (21.0, 0, 0), (17.0, 24, 0)])
+    check_timer("Sat", [(4.5, None, None), (30.0, 0, 10), (0.0, 23, 50)])
+    assert raises(enc.set_timer, "mon", [(17.0, None, None)] + [(20.0, h, 0) for h in range(1, 8)])
+    assert raises(enc.set_timer, "mon", [(17.0, None, None), (20.0, 24, 10)])
+    assert raises(enc.set_timer, "xyz", [(17.0, None, None)])
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} ok")
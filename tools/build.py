@@ -0,0 +1,74 @@
+# Precompile the Eqiva modules and the MQTT gateway to .mpy bytecode
+# v0.2 (c) Copyright prefixFelix 2025
+#
+# Needs mpy-cross of the firmware's MicroPython version (pip install mpy-cross==<version>):
+#   $ python3 tools/build.py [dist] [mpy-cross options, e.g. -march=xtensawin -O2]
+#   $ mpremote connect /dev/ttyUSB0 cp -r dist/. :
+# config.py stays source (it holds the settings), main.py starts the precompiled gateway.
+# To freeze the modules into the firmware instead, see manifest.py.
+
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (source, destination directory in dist)
+MODULES = (
+    ('eq3codec.py', 'lib'),
+    ('eqiva.py', 'lib'),
+    ('aeqiva.py', 'lib'),
+    ('mqtt-gateway/cmdqueue.py', ''),
+    ('mqtt-gateway/journal.py', ''),
+    ('mqtt-gateway/mqttlink.py', ''),
+    ('mqtt-gateway/poller.py', ''),
+    ('mqtt-gateway/pool.py', ''),
+    ('mqtt-gateway/shadow.py', ''),
+    ('mqtt-gateway/state.py', ''),
+    ('mqtt-gateway/gateway.py', ''),
+)
+SOURCES = ('mqtt-gateway/config.py', 'mqtt-gateway/main.py')  # Copied as they are
+
+
+def mpy_cross():
+    """Command to run mpy-cross: the executable on PATH or the mpy_cross pip package."""
+    if shutil.which('mpy-cross'):
+        return ['mpy-cross']
+    try:
+        import mpy_cross  # noqa: F401
+    except ImportError:
+        sys.exit("mpy-cross not found, install it with: pip install mpy-cross==<firmware version>")
+    return [sys.executable, '-m', 'mpy_cross']
+
+
+def build(dist, options):
+    cmd = mpy_cross()
+    total_py = total_mpy = 0
+    print(f"{'module':<28} {'.py':>7} {'.mpy':>7}")
+    for src, dest in MODULES:
+        out_dir = os.path.join(dist, dest)
+        os.makedirs(out_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(src))[0]
+        out = os.path.join(out_dir, name + '.mpy')
+        # -s keeps tracebacks short: the file name without the build path
+        subprocess.run(cmd + options + ['-s', name + '.py', '-o', out, os.path.join(ROOT, src)], check=True)
+        size_py = os.path.getsize(os.path.join(ROOT, src))
+        size_mpy = os.path.getsize(out)
+        total_py += size_py
+        total_mpy += size_mpy
+        print(f"{os.path.join(dest, name + '.mpy'):<28} {size_py:>7} {size_mpy:>7}")
+    print(f"{'total':<28} {total_py:>7} {total_mpy:>7}")
+
+    for src in SOURCES:
+        shutil.copy(os.path.join(ROOT, src), dist)
+        print(f"{os.path.basename(src):<28} copied")
+
+
+def main(argv):
+    dist = argv[1] if len(argv) > 1 and not argv[1].startswith('-') else os.path.join(ROOT, 'dist')
+    options = [arg for arg in argv[1:] if arg.startswith('-')]
+    build(dist, options)
+
+
+main(sys.argv)
@@ -0,0 +1,130 @@
+# Memory budget check: heap cost of importing each Eqiva / gateway module
+# v0.2 (c) Copyright prefixFelix 2025
+#
+# ESP32, after installing the modules (source, .mpy from tools/build.py or frozen):
+#   $ mpremote connect /dev/ttyUSB0 run tools/memcheck.py
+# PC (CPython allocations, only useful to compare changes):
+#   $ python3 tools/memcheck.py
+#
+# Per module: "import" is the heap allocated while importing (compiling a .py source needs most of it),
+# "resident" what stays allocated afterwards. Resident sizes are checked against BUDGET and the free
+# heap after importing everything against MIN_FREE (TLS buffers, BLE connections, MQTT messages).
+
+import gc
+import sys
+
+# Resident heap per module (B) on MicroPython, about 1.5 x the .mpy size. Tune them with the report
+# of a known good build.
+BUDGET = {
+    'eq3codec': 6000,
+    'eqiva': 16000,
+    'aeqiva': 11000,
+    'cmdqueue': 1500,
+    'journal': 4000,
+    'mqttlink': 2500,
+    'poller': 1500,
+    'pool': 2000,
+    'shadow': 3000,
+    'state': 1500,
+    'config': 1000,
+    'gateway': 13000,
+}
+MIN_FREE = 60000  # B of free heap left after all imports
+
+# Imported first, so their cost is not counted for the module that happens to import them first
+SYSTEM = ('asyncio', 'json', 'bluetooth', 'micropython', 'time', 'random')
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+if sys.implementation.name != 'micropython':
+    import os
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:0] = [root, os.path.join(root, 'mqtt-gateway')]
+
+
+def mem_alloc():
+    return tracemalloc.get_traced_memory()[0] if tracemalloc else gc.mem_alloc()
+
+
+def mem_free():
+    return None if tracemalloc else gc.mem_free()
+
+
+def measure(name):
+    """(import cost, resident size) of importing a module in B, import cost None if unknown."""
+    gc.collect()
+    start = mem_alloc()
+    if tracemalloc:
+        tracemalloc.reset_peak()
+        __import__(name)
+        cost = tracemalloc.get_traced_memory()[1] - start
+    else:
+        gc.disable()  # mem_alloc() only grows while the GC is off
+        try:
+            __import__(name)
+            cost = mem_alloc() - start
+        except MemoryError:  # Not enough heap to compile without collecting
+            gc.enable()
+            gc.collect()
+            __import__(name)
+            cost = None
+        gc.enable()
+    gc.collect()
+    return cost, mem_alloc() - start
+
+
+def kind(name):
+    """Where a module was loaded from: frozen, mpy or py."""
+    path = getattr(sys.modules[name], '__file__', '')
+    if path.startswith('.frozen') or not path:
+        return 'frozen'
+    return 'mpy' if path.endswith('.mpy') else 'py'
+
+
+def main():
+    if tracemalloc:
+        tracemalloc.start()
+    for name in SYSTEM:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    gc.collect()
+
+    print(f"{'module':<10} {'kind':<7} {'import':>8} {'resident':>9} {'budget':>7}")
+    over = 0
+    total = 0
+    for name, budget in BUDGET.items():
+        if name in sys.modules:
+            print(f"{name:<10} already imported, not measured")
+            continue
+        try:
+            cost, resident = measure(name)
+        except ImportError as e:
+            print(f"{name:<10} not installed ({e})")
+            continue
+        total += resident
+        cost = '-' if cost is None else cost
+        if tracemalloc:  # CPython objects are much larger, the budgets do not apply
+            verdict = ''
+        else:
+            verdict = 'ok' if resident <= budget else 'OVER'
+            over += resident > budget
+        print(f"{name:<10} {kind(name):<7} {cost:>8} {resident:>9} {budget:>7} {verdict}")
+    print(f"{'total':<10} {'':<7} {'':>8} {total:>9}")
+
+    free = mem_free()
+    if free is not None:
+        print(f"free heap: {free} B (min. {MIN_FREE} B) {'ok' if free >= MIN_FREE else 'TOO LOW'}")
+        over += free < MIN_FREE
+    if tracemalloc:
+        tracemalloc.stop()
+    if over:
+        print(f"{over} budget(s) exceeded")
+        sys.exit(1)
+
+
+main()